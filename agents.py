@@ -0,0 +1,85 @@
+'''
+Description:
+*   Struct-of-arrays storage for agents. One AgentTable per graph holds
+    contiguous float64 score and coop_prob columns indexed by node
+    position, instead of one Node object per vertex.
+*   AgentView is a Node-compatible handle on a single row, created on
+    demand by graph.get_agent, so per-agent code (printing, Node methods)
+    keeps working without storing an object per node.
+'''
+import numpy as np
+from node import Node
+
+
+class AgentTable():
+
+    def __init__(self, ids, score, coop_prob):
+        self.ids = list(ids)
+        n = len(self.ids)
+        self.score = np.array(np.broadcast_to(score, n), dtype=np.float64)
+        self.coop_prob = np.array(np.broadcast_to(coop_prob, n), dtype=np.float64)
+        # Graphs built by networkx generators are labelled 0..n-1 in order,
+        # in which case the label is its own index and no dict is needed
+        if self.ids == list(range(n)):
+            self.index = None
+        else:
+            self.index = {u: i for i, u in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, u):
+        if self.index is None:
+            return u
+        return self.index[u]
+
+    def positions(self, nodes):
+        if self.index is None:
+            return np.fromiter(nodes, dtype=np.intp)
+        return np.fromiter((self.index[u] for u in nodes), dtype=np.intp)
+
+    def view(self, u):
+        return AgentView(self, self.position(u))
+
+    def __repr__(self):
+        return f"AgentTable({len(self)} agents)"
+
+
+class AgentView(Node):
+
+    # Payoffs normally set per instance in Node.__init__
+    sucker = 3
+    punishment = 2
+    reward = 1
+    temptation = 0
+
+    def __init__(self, table, i):
+        self.table = table
+        self.i = i
+
+    @property
+    def id(self):
+        return self.table.ids[self.i]
+
+    @property
+    def score(self):
+        return float(self.table.score[self.i])
+
+    @score.setter
+    def score(self, value):
+        self.table.score[self.i] = value
+
+    @property
+    def coop_prob(self):
+        return float(self.table.coop_prob[self.i])
+
+    @coop_prob.setter
+    def coop_prob(self, value):
+        self.table.coop_prob[self.i] = value
+
+    def __eq__(self, other):
+        return (isinstance(other, AgentView)
+                and other.table is self.table and other.i == self.i)
+
+    def __hash__(self):
+        return hash((id(self.table), self.i))
@@ -0,0 +1,97 @@
+'''
+Description:
+*   Closed-form expected scores for rounds played without takeover.
+    With fixed coop_probs every game is independent, and the payoff of
+    u against v has mean
+        E(p_u, p_v) = a_u + b_u * p_v
+    where a_u and b_u depend only on p_u and the payoff table. Summed over
+    u's neighbors this only needs u's degree and (A p)_u, the sum of its
+    neighbors' coop_probs, and the variance also needs (A p^2)_u. Both
+    come from one pass over the edge list, a sparse matrix-vector product.
+*   A self-loop is one game where u plays itself with two independent
+    draws and gets both payoffs, so loops are added separately.
+*   With n rounds the mean and variance of a score are n times those of
+    one round.
+'''
+import numpy as np
+from engine import RoundEngine
+from game import payoff_table
+from helpers import make_rng
+
+
+# a_u, b_u of E(p_u, p_v) = a_u + b_u * p_v for a payoff table
+# indexed [own choice][opponent choice]
+def _bilinear(table, p):
+    a = table[0, 0] + p * (table[1, 0] - table[0, 0])
+    b = (table[0, 1] - table[0, 0]) + p * (table[1, 1] - table[1, 0] - table[0, 1] + table[0, 0])
+    return a, b
+
+
+'''
+Expected score and its variance after some rounds without takeover
+@param graph: CompactGraph. Only its live nodes and edges play.
+@param coop_prob: Coop_prob of every snapshot position
+@param n_rounds: Rounds played
+@param payoffs: Payoff table as built by game.payoff_table
+@return: (mean, variance) arrays of the score gained by each position
+'''
+def expected_scores(graph, coop_prob, n_rounds=1, payoffs=None):
+    table = payoff_table() if payoffs is None else np.asarray(payoffs, dtype=np.float64)
+    p = np.asarray(coop_prob, dtype=np.float64)
+    n = len(p)
+    src, dst = graph.live_edges()
+    loops = src == dst
+    s, d = src[~loops], dst[~loops]
+    degree = np.bincount(s, minlength=n) + np.bincount(d, minlength=n)
+    # A p and A p^2, as one pass over the edges in both directions
+    ends = np.concatenate([s, d])
+    nbrs = np.concatenate([d, s])
+    Ap = np.bincount(ends, weights=p[nbrs], minlength=n)
+    Ap2 = np.bincount(ends, weights=p[nbrs]**2, minlength=n)
+    a, b = _bilinear(table, p)
+    a2, b2 = _bilinear(table**2, p)
+    mean = degree * a + b * Ap
+    # Sum over neighbors of E[pay^2] - E[pay]^2
+    var = degree * (a2 - a**2) + (b2 - 2*a*b) * Ap - b**2 * Ap2
+    n_loops = np.bincount(src[loops], minlength=n)
+    if n_loops.any():
+        # One loop game pays T[x][y] + T[y][x] for independent x, y
+        both = table + table.T
+        q = np.stack([1 - p, p])
+        joint = q[:, None, :] * q[None, :, :]
+        loop_mean = np.einsum('xy,xyn->n', both, joint)
+        loop_sq = np.einsum('xy,xyn->n', both**2, joint)
+        mean += n_loops * loop_mean
+        var += n_loops * (loop_sq - loop_mean**2)
+    # Rounding can leave tiny negatives where the variance is 0
+    return n_rounds * mean, n_rounds * np.maximum(var, 0)
+
+
+'''
+Compare expected_scores with simulated rounds
+@param n_iter: Simulated replicates, each starting from a score of 0
+@param rng: numpy Generator for the simulation
+@return: Dict with the analytic and sampled 'mean' and 'var' per
+         position, and 'max_z', the largest gap between the means in
+         standard errors (positions with no variance are compared exactly)
+'''
+def check_monte_carlo(graph, coop_prob, n_rounds=20, n_iter=200, rng=None, payoffs=None):
+    rng = make_rng(rng)
+    mean, var = expected_scores(graph, coop_prob, n_rounds, payoffs)
+    samples = np.empty((n_iter, len(mean)))
+    for i in range(n_iter):
+        engine = RoundEngine(graph, np.array(coop_prob, dtype=np.float64), np.zeros(len(mean)), payoffs)
+        for _ in range(n_rounds):
+            engine.play_round(takeover=False, rng=rng)
+        samples[i] = engine.score
+    mc_mean = samples.mean(axis=0)
+    gap = np.abs(mc_mean - mean)
+    random = var > 0
+    z = np.where(random, gap / np.sqrt(np.where(random, var, 1) / n_iter), np.where(gap > 1e-9, np.inf, 0))
+    return {
+        'mean': mean,
+        'var': var,
+        'mc_mean': mc_mean,
+        'mc_var': samples.var(axis=0, ddof=1) if n_iter > 1 else np.zeros(len(mean)),
+        'max_z': float(z[graph.live].max()) if graph.live.any() else 0.0,
+    }
@@ -0,0 +1,182 @@
+'''
+Description:
+*   Batched engine for independent replicates on one graph. The state is
+    an (R, N) matrix of coop_probs and scores, one row per replicate, and
+    every row plays the same shared edge index. A round draws the choices
+    of all replicates at once and scores them with one bincount over
+    the flattened matrix, so the per-round Python overhead is paid once
+    per batch rather than once per replicate.
+*   Each row can have its own Generator. Row r then plays exactly as a
+    RoundEngine driven by that Generator, so batching does not change
+    the results of seeded sweeps.
+*   Rows share the graph's live mask, so agents cannot be killed
+    per replicate.
+*   multiedges picks how rounds without takeover play parallel edges,
+    as for RoundEngine. 'weighted' rounds are batched over the distinct
+    edges; 'binomial' rounds draw a varying number of uniforms per edge,
+    so each row plays its round from its own Generator in turn.
+'''
+import numpy as np
+from game import GameSpec
+from engine import RoundEngine
+import profiling
+
+# Bytes a round works through per replicate and edge: two uniforms,
+# two gathered coop_probs, two payoffs and two flat indices, 8 bytes
+# each, and the two choices
+ROW_EDGE_BYTES = 8 * 8 + 2
+# Working set of a batch's round. Rounds are memory-bound, so small
+# graphs get as many rows as stay near the cache, while large graphs
+# still batch MIN_ROWS replicates to share the per-round overhead.
+BATCH_BYTES = 2**22
+MIN_ROWS = 2
+
+
+'''
+Replicates that fit one batch
+@param n_edges: Live edges of the graph
+@param max_bytes: Working set budget of a round
+'''
+def batch_rows(n_edges, max_bytes=BATCH_BYTES):
+    return max(MIN_ROWS, max_bytes // (ROW_EDGE_BYTES * max(1, n_edges)))
+
+
+class BatchEngine():
+
+    '''
+    @param graph: CompactGraph shared by every replicate
+    @param coop_prob: (R, N) starting coop_probs, one row per replicate
+    @param score: Starting scores, anything that broadcasts to (R, N)
+    @param game: GameSpec with the rules (default: those of Node)
+    @param multiedges: One of MULTIEDGE_MODES, as for RoundEngine
+    '''
+    def __init__(self, graph, coop_prob, score=0, game=None, multiedges='expand'):
+        self.graph = graph
+        self.multiedges = multiedges
+        self.coop_prob = np.array(coop_prob, dtype=np.float64, ndmin=2)
+        self.score = np.array(np.broadcast_to(score, self.coop_prob.shape), dtype=np.float64)
+        self.game = GameSpec() if game is None else game
+        self.payoffs = self.game.payoffs
+        # One engine per row, on views of the matrices, for the in-order
+        # takeover sweep and the absorbing check
+        self.rows = [
+            RoundEngine(graph, self.coop_prob[r], self.score[r], game=self.game, multiedges=multiedges)
+            for r in range(len(self.coop_prob))]
+        self._flat = None
+        self._draws = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    '''
+    Uniforms for one round
+    @param rng: A Generator shared by every row, or a list with one
+                Generator per row, each filling its row in place
+    @return: (R, 2 * n_edges) array, reused by the next round
+    '''
+    def draws(self, rng, n_edges):
+        if not isinstance(rng, (list, tuple)):
+            return rng.random((len(self), 2 * n_edges))
+        if self._draws is None or self._draws.shape[1] != 2 * n_edges:
+            self._draws = np.empty((len(self), 2 * n_edges))
+        for row, r in zip(self._draws, rng):
+            r.random(out=row)
+        return self._draws
+
+    # src and dst offset into the flattened (R, N) matrix, rebuilt only
+    # when the edges change
+    # @param edges: The graph's live_edges() (default) or weighted_edges()
+    def flat_edges(self, edges=None):
+        if edges is None:
+            edges = self.graph.live_edges()
+        if self._flat is None or self._flat[0] is not edges:
+            n_rows, n = self.score.shape
+            offsets = (np.arange(n_rows, dtype=np.intp) * n)[:, None]
+            src, dst = edges[:2]
+            self._flat = (edges, (offsets + src).ravel(), (offsets + dst).ravel())
+        return self._flat[1:]
+
+    '''
+    Play every live edge once in every replicate, as RoundEngine.play_round
+    @param takeover: Rows with takeovers are swept in edge order one at a
+                     time, except absorbing rows, which need no order
+    @return: (self_choices, opponent_choices) boolean (R, E) arrays.
+             Rounds played by multiedges mode return them per distinct
+             edge, as counts of cooperations for 'binomial'.
+    '''
+    def play_round(self, takeover=False, rng=None):
+        if rng is None:
+            rng = np.random
+        if not takeover and self.multiedges == 'weighted':
+            return self._play_weighted(rng)
+        if not takeover and self.multiedges == 'binomial':
+            rngs = rng if isinstance(rng, (list, tuple)) else [rng] * len(self)
+            choices = [row._play_multiedges(r) for row, r in zip(self.rows, rngs)]
+            return tuple(np.array(side) for side in zip(*choices))
+        prof = profiling.active
+        if prof is not None:
+            start = prof.start()
+        src, dst = self.graph.live_edges()
+        draws = self.draws(rng, len(src)).reshape(len(self), -1, 2)
+        opp_draws = draws[:, :, 0]
+        self_draws = draws[:, :, 1]
+        # take is much faster than fancy indexing along the second axis
+        self_choice = self_draws < np.take(self.coop_prob, src, axis=1)
+        opp_choice = opp_draws < np.take(self.coop_prob, dst, axis=1)
+        if takeover:
+            for r, row in enumerate(self.rows):
+                if not row.is_absorbing():
+                    self_choice[r], opp_choice[r] = row._play_sequential(
+                        src, dst, self_draws[r], opp_draws[r])
+        self.add_payoffs(self_choice, opp_choice)
+        if prof is not None:
+            takeovers = self.rows[0].count_takeovers(self_choice, opp_choice) if takeover else 0
+            prof.played(start, self_choice.size, 2 * self_choice.size, takeovers)
+        return self_choice, opp_choice
+
+    # RoundEngine's 'weighted' round for every row: one game per distinct
+    # edge, its payoffs scaled by the edge's multiplicity
+    def _play_weighted(self, rng):
+        prof = profiling.active
+        if prof is not None:
+            start = prof.start()
+        edges = self.graph.weighted_edges()
+        src, dst, multiplicity = edges
+        draws = self.draws(rng, len(src)).reshape(len(self), -1, 2)
+        self_choice = draws[:, :, 1] < np.take(self.coop_prob, src, axis=1)
+        opp_choice = draws[:, :, 0] < np.take(self.coop_prob, dst, axis=1)
+        self_pay = multiplicity * self.payoffs[self_choice.view(np.int8), opp_choice.view(np.int8)]
+        opp_pay = multiplicity * self.payoffs[opp_choice.view(np.int8), self_choice.view(np.int8)]
+        self._add_pay(self_pay, opp_pay, edges)
+        if prof is not None:
+            prof.played(start, len(self) * int(multiplicity.sum()), 2 * self_choice.size)
+        return self_choice, opp_choice
+
+    def add_payoffs(self, self_choice, opp_choice):
+        self_pay = self.payoffs[self_choice.view(np.int8), opp_choice.view(np.int8)]
+        opp_pay = self.payoffs[opp_choice.view(np.int8), self_choice.view(np.int8)]
+        self._add_pay(self_pay, opp_pay)
+
+    # One bincount per side over the flattened (R, N) matrix. Bins are
+    # summed in edge order within each row, as in RoundEngine.
+    def _add_pay(self, self_pay, opp_pay, edges=None):
+        shape = self.score.shape
+        src, dst = self.flat_edges(edges)
+        self.score += np.bincount(src, weights=self_pay.ravel(), minlength=self.score.size).reshape(shape)
+        self.score += np.bincount(dst, weights=opp_pay.ravel(), minlength=self.score.size).reshape(shape)
+
+    '''
+    Per-replicate totals, as a Recorder attached to each row would hold
+    @param threshold: Agents with coop_prob >= threshold are cooperators
+    @return: (coop score sum, coop count, defect score sum, defect count)
+             tuples, one per row
+    '''
+    def totals(self, threshold=0.5):
+        live = self.graph.live
+        is_coop = (self.coop_prob >= threshold) & live
+        is_defect = ~is_coop & live
+        coop_sum = np.where(is_coop, self.score, 0).sum(axis=1)
+        defect_sum = np.where(is_defect, self.score, 0).sum(axis=1)
+        return list(zip(
+            coop_sum.tolist(), np.count_nonzero(is_coop, axis=1).tolist(),
+            defect_sum.tolist(), np.count_nonzero(is_defect, axis=1).tolist()))
@@ -0,0 +1,335 @@
+'''
+Description:
+*   Benchmarks for the simulation and rendering paths: agent setup,
+    the reference update_scores loop, the round engine, test_proportions
+    sized sweeps, and drawing frames, GIFs and streamed animations. Every benchmark runs on
+    the graph families of main.py (configuration model, G(n,p),
+    Barabasi-Albert and complete graphs) at several sizes.
+*   Each case runs in a fresh interpreter in its own temporary working
+    directory, so its peak RSS is its own and rendered files do not
+    pile up. A case reports its rate as calls (rounds, replicates or
+    frames) and games per second.
+*   Reports are JSON and can be saved as a baseline. Comparing a run
+    with a baseline flags every case that got slower than the
+    tolerance, e.g. between engine implementations:
+        python bench.py --save bench/baseline.json
+        python bench.py --compare bench/baseline.json
+'''
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from os import makedirs
+from os.path import abspath, dirname
+from tempfile import TemporaryDirectory
+
+SIZES = [100, 500, 1000]
+LARGE_SIZES = [2000, 5000]
+FAMILIES = ['config', 'gnp', 'barabasi_albert', 'complete']
+BENCHMARKS = [
+    'add_agents', 'update_scores', 'engine', 'engine_takeover',
+    'sweep', 'draw_graph', 'save_gif', 'animation']
+# Shortest time a rate is measured over, in seconds
+MIN_TIME = 0.5
+# Relative slowdown reported as a regression
+TOLERANCE = 0.1
+# Frames drawn by the rendering benchmarks
+N_FRAMES = 4
+
+
+'''
+Build a graph of one of main.py's families
+@return: A seeded networkx graph
+'''
+def build_graph(family, n):
+    import networkx as nx
+    if family == 'config':
+        deg_seq = [3] * n
+        if sum(deg_seq) % 2 != 0:
+            deg_seq[0] += 1
+        return nx.configuration_model(deg_seq, seed=0)
+    if family == 'gnp':
+        return nx.gnp_random_graph(n, 0.05, seed=0)
+    if family == 'barabasi_albert':
+        return nx.barabasi_albert_graph(n, 3, seed=0)
+    if family == 'complete':
+        return nx.complete_graph(n)
+    raise ValueError(f"Unknown graph family {family!r}, expected one of {FAMILIES}")
+
+
+'''
+Call step until at least min_time has passed
+@param setup: Called before every step, outside the timing (Optional)
+@return: (calls, seconds)
+'''
+def measure(step, min_time=MIN_TIME, setup=None):
+    calls = 0
+    elapsed = 0.0
+    while calls == 0 or elapsed < min_time:
+        if setup:
+            setup()
+        start = time.perf_counter()
+        step()
+        elapsed += time.perf_counter() - start
+        calls += 1
+    return calls, elapsed
+
+
+# Half cooperators, half defectors, as in the middle of the sweep
+def _coop_probs(n):
+    return [1.0] * (n // 2) + [0.0] * (n - n // 2)
+
+
+def bench_add_agents(G, min_time):
+    from graph import add_agents
+    coop_probs = _coop_probs(G.number_of_nodes())
+    calls, seconds = measure(lambda: add_agents(G, 0, coop_probs), min_time)
+    return calls, seconds, 0
+
+
+def bench_update_scores(G, min_time):
+    import numpy as np
+    from graph import add_agents, update_scores
+    add_agents(G, 0, _coop_probs(G.number_of_nodes()))
+    rng = np.random.default_rng(0)
+    calls, seconds = measure(lambda: update_scores(G, rng=rng), min_time)
+    return calls, seconds, calls * G.number_of_edges()
+
+
+def _engine(G):
+    from graph import add_agents
+    from compact import CompactGraph
+    from engine import RoundEngine
+    C = CompactGraph.from_networkx(G)
+    add_agents(C, 0, _coop_probs(len(C)))
+    return RoundEngine.from_graph(C)
+
+
+def bench_engine(G, min_time):
+    import numpy as np
+    engine = _engine(G)
+    rng = np.random.default_rng(0)
+    calls, seconds = measure(lambda: engine.play_round(takeover=False, rng=rng), min_time)
+    return calls, seconds, calls * engine.num_edges()
+
+
+# Coop_probs strictly between 0 and 1, reset before every round: left
+# alone, takeovers drive the population to an absorbing state within a
+# few rounds and the in-order sweep is skipped from then on
+def bench_engine_takeover(G, min_time):
+    import numpy as np
+    engine = _engine(G)
+    start = np.random.default_rng(1).uniform(0.2, 0.8, len(engine))
+
+    def reset():
+        engine.coop_prob[:] = start
+        engine.count_states()
+
+    rng = np.random.default_rng(0)
+    calls, seconds = measure(lambda: engine.play_round(takeover=True, rng=rng), min_time, reset)
+    return calls, seconds, calls * engine.num_edges()
+
+
+# Every proportion of test_proportions, one replicate each, so a call
+# is one replicate of 20 rounds
+def bench_sweep(G, min_time):
+    from compact import CompactGraph
+    from sweep import PROPORTIONS, run_proportion_sweep
+    C = CompactGraph.from_networkx(G)
+    start = time.perf_counter()
+    run_proportion_sweep([C], n_iter=1, seed=0, workers=1, batched=True)
+    seconds = time.perf_counter() - start
+    return len(PROPORTIONS), seconds, len(PROPORTIONS) * 20 * C.number_of_edges()
+
+
+def _drawable(G):
+    import networkx as nx
+    from graph import add_agents, set_node_positions
+    add_agents(G, 0, _coop_probs(G.number_of_nodes()))
+    return set_node_positions(G, nx.circular_layout(G))
+
+
+def bench_draw_graph(G, min_time):
+    from compact import CompactGraph
+    from save import GraphRenderer, draw_graph
+    G = _drawable(G)
+    C = CompactGraph.from_networkx(G)
+    renderer = GraphRenderer.from_graph(G, C)
+    frames = iter(range(sys.maxsize))
+    calls, seconds = measure(
+        lambda: draw_graph(G, f'{next(frames)}_frame', 'bench', snapshot=C, renderer=renderer), min_time)
+    return calls, seconds, 0
+
+
+# Frames are drawn first, only save_gif is timed
+def bench_save_gif(G, min_time):
+    from compact import CompactGraph
+    from save import GraphRenderer, draw_graph, save_gif
+    G = _drawable(G)
+    C = CompactGraph.from_networkx(G)
+    renderer = GraphRenderer.from_graph(G, C)
+    for i in range(N_FRAMES):
+        draw_graph(G, f'{i}_frame', 'bench', snapshot=C, renderer=renderer)
+    start = time.perf_counter()
+    save_gif('bench', 'bench')
+    return N_FRAMES, time.perf_counter() - start, 0
+
+
+# N_FRAMES captured frames streamed into one GIF by frames.save_animation,
+# rendered inline so the case measures rendering rather than pool startup
+def bench_animation(G, min_time):
+    import numpy as np
+    from compact import CompactGraph
+    from frames import save_animation
+    G = _drawable(G)
+    C = CompactGraph.from_networkx(G)
+    rng = np.random.default_rng(0)
+    frames = [(C.live.copy(), rng.uniform(0, 100, len(C))) for _ in range(N_FRAMES)]
+    start = time.perf_counter()
+    save_animation(G, C, frames, 'bench/bench.gif', workers=1)
+    return N_FRAMES, time.perf_counter() - start, 0
+
+
+# Peak resident set size of this process, in MB
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, in KB elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+'''
+Run one case in this process
+@return: Result dict with 'calls' per second ('rate'), games per second
+         ('edges_per_s') and the process's 'peak_rss_mb'
+'''
+def run_case(bench, family, n, min_time=MIN_TIME):
+    G = build_graph(family, n)
+    calls, seconds, games = globals()[f'bench_{bench}'](G, min_time)
+    return {
+        'bench': bench,
+        'family': family,
+        'n': n,
+        'edges': G.number_of_edges(),
+        'calls': calls,
+        'seconds': seconds,
+        'rate': calls / seconds,
+        'edges_per_s': games / seconds,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+'''
+Run one case in a fresh interpreter, in a temporary directory
+@return: run_case's result, or a dict with the 'error' if it failed,
+         e.g. when a rendering package is not installed
+'''
+def run_isolated(bench, family, n, min_time=MIN_TIME):
+    case = json.dumps([bench, family, n, min_time])
+    with TemporaryDirectory() as cwd:
+        out = subprocess.run(
+            [sys.executable, abspath(__file__), '--case', case],
+            capture_output=True, text=True, cwd=cwd)
+    if out.returncode != 0:
+        error = (out.stderr.strip().splitlines() or ['failed'])[-1]
+        return {'bench': bench, 'family': family, 'n': n, 'error': error}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def environment():
+    import numpy as np
+    from kernel import sequential_kernel
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'compiled_kernel': sequential_kernel() is not None,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+'''
+Run every combination of benchmark, family and size
+@param on_result: Called with each result as it finishes (Optional)
+@return: Report dict with the 'environment' and a list of 'results'
+'''
+def run_benchmarks(benchmarks=BENCHMARKS, families=FAMILIES, sizes=SIZES, min_time=MIN_TIME, on_result=None):
+    results = []
+    for bench in benchmarks:
+        for family in families:
+            for n in sizes:
+                result = run_isolated(bench, family, n, min_time)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+    return {'environment': environment(), 'results': results}
+
+
+def _key(result):
+    return (result['bench'], result['family'], result['n'])
+
+
+'''
+Compare a report with a baseline report
+@param tolerance: Relative drop in rate reported as a regression
+@return: List of (bench, family, n, baseline rate, rate) for every
+         case that got slower than the tolerance allows
+'''
+def compare(report, baseline, tolerance=TOLERANCE):
+    before = {_key(r): r for r in baseline['results'] if 'error' not in r}
+    regressions = []
+    for result in report['results']:
+        old = before.get(_key(result))
+        if old is None or 'error' in result:
+            continue
+        if result['rate'] < (1 - tolerance) * old['rate']:
+            regressions.append(_key(result) + (old['rate'], result['rate']))
+    return regressions
+
+
+def format_result(result):
+    name = f"{result['bench']:<16} {result['family']:<16} n={result['n']:<6}"
+    if 'error' in result:
+        return f"{name} skipped: {result['error']}"
+    return (f"{name} {result['rate']:>10.2f}/s {result['edges_per_s']:>14,.0f} edges/s "
+            f"{result['peak_rss_mb']:>8.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and rendering paths")
+    parser.add_argument('--bench', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--family', nargs='+', default=FAMILIES, choices=FAMILIES)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--large', action='store_true', help=f"Also run n in {LARGE_SIZES}")
+    parser.add_argument('--min-time', type=float, default=MIN_TIME)
+    parser.add_argument('--save', help="Write the report as JSON, e.g. a new baseline")
+    parser.add_argument('--compare', help="Baseline JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.case:
+        print(json.dumps(run_case(*json.loads(args.case))))
+        return 0
+    sizes = args.sizes + (LARGE_SIZES if args.large else [])
+    report = run_benchmarks(
+        args.bench, args.family, sizes, args.min_time,
+        on_result=lambda result: print(format_result(result), flush=True))
+    if args.save:
+        if dirname(args.save):
+            makedirs(dirname(args.save), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for bench, family, n, old, new in regressions:
+            print(f"Regression: {bench} {family} n={n}: {old:.2f}/s -> {new:.2f}/s")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,348 @@
+'''
+Description:
+*   Frozen compressed sparse row (CSR) snapshot of a networkx graph.
+    Built once, it holds the adjacency as indptr/indices arrays in the
+    graph's own adjacency order, plus the edge list as (src, dst)
+    position arrays in G.edges() order.
+*   Nodes are removed through a live mask rather than G.remove_node.
+    Removing nodes from a networkx graph keeps the order of what is
+    left, so the live edges come out in the same order G.edges() would
+    give after the same removals.
+*   The snapshot shares G.graph, so agents added with add_agents on
+    either the snapshot or the source graph are visible to both.
+'''
+from os import makedirs
+from os.path import join, exists
+import numpy as np
+
+# Arrays that never change once built, shared by copies and saved to disk
+ARRAYS = ['indptr', 'indices', 'src', 'dst', 'edge_of']
+SELF_LOOPS = ['keep', 'drop']
+
+
+class CompactGraph():
+
+    '''
+    @param edges: Optional precomputed (src, dst, edge_of), e.g. from a
+                  saved or copied snapshot, to skip rebuilding them
+    '''
+    def __init__(self, node_ids, indptr, indices, graph=None, edges=None):
+        self.node_ids = list(node_ids)
+        self.indptr = np.asarray(indptr, dtype=np.intp)
+        self.indices = np.asarray(indices, dtype=np.intp)
+        self.graph = {} if graph is None else graph
+        self.live = np.ones(len(self.node_ids), dtype=bool)
+        if edges is None:
+            self._build_edges()
+        else:
+            self.src, self.dst, self.edge_of = edges
+        # Set when the arrays are memory-mapped from a saved snapshot
+        self.path = None
+        self._live_edges = None
+        self._live_edge_ids = None
+        self._live_nodes = None
+        self._weighted_edges = None
+        self._index = None
+
+    '''
+    Snapshot a networkx graph
+    @param G: Any networkx Graph or MultiGraph. Parallel edges appear
+              once per key and self-loops once, as in G.edges().
+    @param self_loops: 'keep' them, so a node plays itself as in
+                       update_scores, or 'drop' them from the snapshot
+    @return: A CompactGraph with nodes numbered in G.nodes() order
+    '''
+    @classmethod
+    def from_networkx(cls, G, self_loops='keep'):
+        if self_loops not in SELF_LOOPS:
+            raise ValueError(f"Unknown self-loop policy {self_loops!r}, expected one of {SELF_LOOPS}")
+        drop_loops = self_loops == 'drop'
+        node_ids = list(G.nodes())
+        index = {u: i for i, u in enumerate(node_ids)}
+        multi = G.is_multigraph()
+        degrees = []
+        indices = []
+        for u, nbrs in G.adj.items():
+            start = len(indices)
+            for v, data in nbrs.items():
+                if drop_loops and v == u:
+                    continue
+                if multi:
+                    indices += [index[v]] * len(data)
+                else:
+                    indices.append(index[v])
+            degrees.append(len(indices) - start)
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.intp)
+        np.cumsum(degrees, out=indptr[1:])
+        return cls(node_ids, indptr, indices, graph=G.graph)
+
+    '''
+    Save the arrays as .npy files in a directory
+    @param path: Directory to write, created if needed
+    '''
+    def save(self, path):
+        makedirs(path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(join(path, f'{name}.npy'), getattr(self, name))
+        if self.node_ids != list(range(len(self))):
+            # Saved as objects, so labels keep their type: numpy would
+            # turn tuple labels (grid graphs) into rows of a 2D array,
+            # and a mix of ints and strings into strings
+            node_ids = np.empty(len(self), dtype=object)
+            for i, u in enumerate(self.node_ids):
+                node_ids[i] = u
+            np.save(join(path, 'node_ids.npy'), node_ids)
+
+    '''
+    Load a saved snapshot without rebuilding anything
+    @param mmap_mode: Passed to numpy.load. The default 'r' maps the
+                      files read-only, so processes loading the same
+                      snapshot share one copy in the page cache.
+    '''
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        arrays = {name: np.load(join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAYS}
+        if exists(join(path, 'node_ids.npy')):
+            node_ids = np.load(join(path, 'node_ids.npy'), allow_pickle=True)
+            if node_ids.ndim > 1:
+                # Tuple labels saved as a 2D array by older versions
+                node_ids = [tuple(u) for u in node_ids.tolist()]
+            else:
+                node_ids = node_ids.tolist()
+        else:
+            node_ids = range(len(arrays['indptr']) - 1)
+        C = cls(
+            node_ids, arrays['indptr'], arrays['indices'],
+            edges=(arrays['src'], arrays['dst'], arrays['edge_of']))
+        C.path = path
+        C.mmap_mode = mmap_mode
+        return C
+
+    # A fresh snapshot of the same graph: arrays are shared, while the
+    # live mask and graph dict (agents) are the copy's own
+    def copy(self):
+        C = CompactGraph(
+            self.node_ids, self.indptr, self.indices,
+            edges=(self.src, self.dst, self.edge_of))
+        C.live[:] = self.live
+        C.path = self.path
+        if self.path is not None:
+            C.mmap_mode = self.mmap_mode
+        return C
+
+    # Snapshots loaded from disk pickle without their arrays, and map
+    # the files again when unpickled, e.g. in pool workers
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_live_edges'] = None
+        state['_live_edge_ids'] = None
+        state['_live_nodes'] = None
+        state['_weighted_edges'] = None
+        if self.path is not None:
+            for name in ARRAYS:
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.path is not None:
+            for name in ARRAYS:
+                setattr(self, name, np.load(join(self.path, f'{name}.npy'), mmap_mode=self.mmap_mode))
+
+    # Edge list in G.edges() order: row u keeps the neighbors that come
+    # at or after u, and edge_of maps every CSR entry to its edge id
+    def _build_edges(self):
+        n = len(self.node_ids)
+        rows = np.repeat(np.arange(n, dtype=np.intp), np.diff(self.indptr))
+        upper = self.indices >= rows
+        self.src = rows[upper]
+        self.dst = self.indices[upper]
+        self.edge_of = np.empty(len(self.indices), dtype=np.intp)
+        self.edge_of[upper] = np.arange(len(self.src), dtype=np.intp)
+        # Each lower entry (v, u) pairs with the upper entry (u, v);
+        # stable sorts keep parallel edges matched in key order
+        lower = np.flatnonzero(~upper)
+        loops = self.src == self.dst
+        pairs = np.flatnonzero(~loops)
+        by_pair = pairs[np.lexsort((self.dst[pairs], self.src[pairs]))]
+        lower_by_pair = lower[np.lexsort((rows[lower], self.indices[lower]))]
+        self.edge_of[lower_by_pair] = by_pair
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def nodes(self):
+        return [self.node_ids[i] for i in np.flatnonzero(self.live)]
+
+    # Node ids to positions, building the lookup on first use. As with
+    # networkx nbunches, a single node of the graph counts as [node].
+    def positions(self, nodes):
+        if self._index is None:
+            self._index = {u: i for i, u in enumerate(self.node_ids)}
+        try:
+            if nodes in self._index:
+                nodes = [nodes]
+        except TypeError:
+            # Unhashable, so a container of nodes
+            pass
+        return np.fromiter((self._index[u] for u in nodes), dtype=np.intp)
+
+    def number_of_nodes(self):
+        return int(np.count_nonzero(self.live))
+
+    def number_of_edges(self):
+        return len(self.live_edges()[0])
+
+    '''
+    Edges whose endpoints are both alive
+    @return: (src, dst) position arrays, in G.edges() order
+    '''
+    def live_edges(self):
+        if self._live_edges is None:
+            ids = self.live_edge_ids()
+            self._live_edges = (self.src[ids], self.dst[ids])
+        return self._live_edges
+
+    '''
+    Live edges with parallel edges collapsed. The keys of a multi-edge
+    are consecutive in G.edges() order, so this is a run-length encoding
+    of live_edges(), kept until the live mask changes.
+    @return: (src, dst, multiplicity) arrays, one entry per distinct
+             edge. Repeating each edge multiplicity times gives back
+             live_edges().
+    '''
+    def weighted_edges(self):
+        if self._weighted_edges is None:
+            src, dst = self.live_edges()
+            first = np.ones(len(src), dtype=bool)
+            first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+            starts = np.flatnonzero(first)
+            multiplicity = np.diff(np.append(starts, len(src)))
+            self._weighted_edges = (src[starts], dst[starts], multiplicity)
+        return self._weighted_edges
+
+    # Ids of the live edges, i.e. their indices into src and dst
+    def live_edge_ids(self):
+        if self._live_edge_ids is None:
+            self._live_edge_ids = np.flatnonzero(self.edge_live())
+        return self._live_edge_ids
+
+    def live_nodes(self):
+        if self._live_nodes is None:
+            self._live_nodes = np.flatnonzero(self.live)
+        return self._live_nodes
+
+    def edge_live(self):
+        return self.live[self.src] & self.live[self.dst]
+
+    '''
+    Live edges incident to some nodes, without visiting any others
+    @param positions: Node positions, in the order G.edges(nbunch) would
+                      visit them
+    @return: (src, dst) position arrays matching G.edges(nbunch): each
+             edge once, oriented away from the first bunch node to reach it
+    '''
+    def incident_edges(self, positions):
+        positions = np.asarray(positions, dtype=np.intp)
+        _, first = np.unique(positions, return_index=True)
+        positions = positions[np.sort(first)]
+        positions = positions[self.live[positions]]
+        if len(positions) == 0:
+            return positions, positions
+        starts = self.indptr[positions]
+        lengths = self.indptr[positions + 1] - starts
+        # CSR entries of every bunch row, concatenated in bunch order
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        entries = offsets + np.arange(lengths.sum(), dtype=np.intp)
+        src = np.repeat(positions, lengths)
+        dst = self.indices[entries]
+        # G.edges(nbunch) skips neighbors that came earlier in the bunch.
+        # Ranks are looked up by binary search to avoid an O(N) array.
+        order = np.argsort(positions)
+        sorted_positions = positions[order]
+        found = np.minimum(np.searchsorted(sorted_positions, dst), len(positions) - 1)
+        in_bunch = sorted_positions[found] == dst
+        dst_rank = np.where(in_bunch, order[found], len(positions))
+        src_rank = np.repeat(np.arange(len(positions)), lengths)
+        keep = self.live[dst] & (dst_rank >= src_rank)
+        return src[keep], dst[keep]
+
+    '''
+    Sum of some values over every node's live neighbors, in one sparse
+    matrix-vector product over the live edges
+    @param values: Array by position
+    @return: (sums, live degrees) by position. A self-loop counts its
+             node twice, as networkx degrees do.
+    '''
+    def neighbor_sum(self, values):
+        src, dst = self.live_edges()
+        n = len(self)
+        values = np.asarray(values, dtype=np.float64)
+        sums = np.bincount(src, weights=values[dst], minlength=n)
+        sums += np.bincount(dst, weights=values[src], minlength=n)
+        return sums, self.degree()
+
+    '''
+    A copy without the dead nodes, so later passes only visit live ones.
+    Renumbering keeps the order of what is left, so edges come out in
+    the same order as live_edges().
+    @return: (CompactGraph, nodes, edges) where nodes and edges are the
+             old positions and edge ids of the new ones. The copy gets
+             a new graph dict, since agent tables are per position.
+    '''
+    def compacted(self):
+        n = len(self)
+        keep = self.live_nodes()
+        new_position = np.full(n, -1, dtype=np.intp)
+        new_position[keep] = np.arange(len(keep), dtype=np.intp)
+        rows = np.repeat(np.arange(n, dtype=np.intp), np.diff(self.indptr))
+        entries = self.live[rows] & self.live[self.indices]
+        counts = np.bincount(new_position[rows[entries]], minlength=len(keep))
+        indptr = np.zeros(len(keep) + 1, dtype=np.intp)
+        np.cumsum(counts, out=indptr[1:])
+        C = CompactGraph(
+            [self.node_ids[i] for i in keep], indptr,
+            new_position[self.indices[entries]], graph=dict(self.graph))
+        return C, keep, self.live_edge_ids()
+
+    def neighbors(self, i):
+        nbrs = self.indices[self.indptr[i]:self.indptr[i+1]]
+        return nbrs[self.live[nbrs]]
+
+    def degree(self):
+        src, dst = self.live_edges()
+        n = len(self)
+        return np.bincount(src, minlength=n) + np.bincount(dst, minlength=n)
+
+    '''
+    Remove nodes by position without touching any arrays but the mask
+    @param positions: Node positions (or a boolean mask) to mark dead
+    '''
+    def remove_positions(self, positions):
+        self.live[positions] = False
+        self._live_edges = None
+        self._live_edge_ids = None
+        self._live_nodes = None
+        self._weighted_edges = None
+
+    # Mark dead positions alive again, e.g. for a newborn agent
+    def add_positions(self, positions):
+        self.live[positions] = True
+        self._live_edges = None
+        self._live_edge_ids = None
+        self._live_nodes = None
+        self._weighted_edges = None
+
+    def set_live(self, mask):
+        self.live[:] = mask
+        self._live_edges = None
+        self._live_edge_ids = None
+        self._live_nodes = None
+        self._weighted_edges = None
+
+    def remove_nodes_from(self, nodes):
+        self.remove_positions(self.positions(nodes))
+
+    def __repr__(self):
+        return (f"CompactGraph({self.number_of_nodes()} nodes, "
+                f"{self.number_of_edges()} edges)")
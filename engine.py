@@ -0,0 +1,434 @@
+'''
+Description:
+*   Array-backed round engine. Cooperation probabilities and scores
+    live in flat numpy arrays indexed by node position, and edges are
+    read as (src, dst) index arrays in G.edges() order from a
+    CompactGraph snapshot. A round draws every choice with a single RNG
+    call and adds payoffs with bincount, instead of calling
+    Node.update_score once per edge.
+*   Results match graph.update_scores given the same random stream:
+    each edge consumes two uniforms (opponent first, then self), the
+    same order Node.update_score calls Node.strategy.
+*   On multigraphs, rounds without takeover can play each multi-edge
+    once: 'weighted' draws one game and counts it multiplicity times,
+    and 'binomial' draws how many of the multiplicity games each side
+    cooperates in, which gives the scores of that many separate games.
+'''
+import numpy as np
+from game import GameSpec
+from graph import get_agent_table
+from agents import AgentTable
+from kill import NeighborMean, kill_caps
+from kernel import sequential_kernel, run_kernel
+from compact import CompactGraph
+from helpers import get_rng_state, set_rng_state, skip_draws
+import profiling
+
+# How play_round plays the parallel edges of a multigraph
+MULTIEDGE_MODES = ['expand', 'weighted', 'binomial']
+
+
+class RoundEngine():
+
+    '''
+    @param payoffs: Payoff table, a shortcut for GameSpec(payoffs)
+    @param game: GameSpec with the rules (default: those of Node)
+    @param compact_threshold: Dead fraction of the positions at which a
+                              kill compacts the arrays (None: never)
+    @param multiedges: One of MULTIEDGE_MODES, for rounds without
+                       takeover. 'expand' plays every parallel edge as
+                       update_scores does.
+    '''
+    def __init__(self, graph, coop_prob, score, payoffs=None, game=None, compact_threshold=None,
+                 multiedges='expand'):
+        if multiedges not in MULTIEDGE_MODES:
+            raise ValueError(f"Unknown multi-edge mode {multiedges!r}, expected one of {MULTIEDGE_MODES}")
+        self.graph = graph
+        self.compact_threshold = compact_threshold
+        self.multiedges = multiedges
+        self.coop_prob = np.asarray(coop_prob, dtype=np.float64)
+        self.score = np.asarray(score, dtype=np.float64)
+        self.game = GameSpec(payoffs) if game is None else game
+        self.payoffs = self.game.payoffs
+        # Set by Recorder.attach, told about every change the engine makes
+        self.recorder = None
+        self.count_states()
+
+    '''
+    Build an engine from a graph whose nodes already carry agents
+    @param G: A CompactGraph, or a networkx graph to snapshot, populated
+              by add_agents or add_rand_agents
+    @param agent_tag: Where the AgentTable is stored in G.graph
+    @param game: GameSpec with the rules (default: those of Node)
+    @param multiedges: As for __init__
+    @return: A RoundEngine working directly on the agent table's columns,
+             so get_agent(G, u) sees every round without a write back
+    '''
+    @classmethod
+    def from_graph(cls, G, agent_tag='agent', game=None, multiedges='expand'):
+        if not isinstance(G, CompactGraph):
+            G = CompactGraph.from_networkx(G)
+        table = get_agent_table(G, agent_tag)
+        if table.ids != G.node_ids:
+            raise ValueError("Agent table does not match the graph's nodes, call add_agents again")
+        return cls(G, table.coop_prob, table.score, game=game, multiedges=multiedges)
+
+    @property
+    def nodes(self):
+        return self.graph.node_ids
+
+    @property
+    def src(self):
+        return self.graph.live_edges()[0]
+
+    @property
+    def dst(self):
+        return self.graph.live_edges()[1]
+
+    def __len__(self):
+        return len(self.graph)
+
+    def num_edges(self):
+        return len(self.src)
+
+    '''
+    Count the live agents whose coop_prob is exactly 0 or 1. Takeovers
+    and kills keep the counts up to date, so this is only needed again
+    after coop_prob or the live mask are changed from outside.
+    '''
+    def count_states(self):
+        live = self.graph.live
+        self.n_live = int(np.count_nonzero(live))
+        self.n_zero = int(np.count_nonzero(self.coop_prob[live] == 0))
+        self.n_one = int(np.count_nonzero(self.coop_prob[live] == 1))
+        # Cached edge check of is_absorbing, cleared by any change
+        self._absorbing = None
+
+    # Every live agent always defects, or every one always cooperates
+    def is_fixated(self):
+        return self.n_live > 0 and (self.n_zero == self.n_live or self.n_one == self.n_live)
+
+    '''
+    Whether takeovers can no longer change any coop_prob. A takeover
+    needs one player to cooperate while the other defects, which cannot
+    happen once every agent has coop_prob 0 or 1 and every live edge
+    joins two agents with the same one.
+    O(1) unless every agent is 0 or 1 without fixation, when the live
+    edges are checked once and the answer kept until the next change.
+    '''
+    def is_absorbing(self):
+        if self.n_zero + self.n_one != self.n_live:
+            return False
+        if self.is_fixated() or self.n_live == 0:
+            return True
+        if self._absorbing is None:
+            src, dst = self.graph.live_edges()
+            self._absorbing = bool(np.array_equal(self.coop_prob[src], self.coop_prob[dst]))
+        return self._absorbing
+
+    '''
+    Score gained by every agent in one round once absorbing, when every
+    choice is fixed
+    @return: Array of gains, by position
+    '''
+    def round_payoffs(self):
+        src, dst = self.graph.live_edges()
+        self_choice = self.coop_prob[src] == 1
+        opp_choice = self.coop_prob[dst] == 1
+        n = len(self)
+        self_pay = self.payoffs[self_choice.view(np.int8), opp_choice.view(np.int8)]
+        opp_pay = self.payoffs[opp_choice.view(np.int8), self_choice.view(np.int8)]
+        return np.bincount(src, weights=self_pay, minlength=n) + np.bincount(dst, weights=opp_pay, minlength=n)
+
+    '''
+    Play several rounds at once from an absorbing state. Scores end up
+    as after play_round n_rounds times, and rng skips the draws those
+    rounds would have used, so a run can carry on as if they were played.
+    @raise ValueError: If the state is not absorbing
+    '''
+    def fast_forward(self, n_rounds, rng=None):
+        if not self.is_absorbing():
+            raise ValueError("Only absorbing states can be fast-forwarded")
+        gain = n_rounds * self.round_payoffs()
+        self.score += gain
+        skip_draws(np.random if rng is None else rng, 2 * self.num_edges() * n_rounds)
+        if profiling.active is not None:
+            profiling.active.count('rng_skipped', 2 * self.num_edges() * n_rounds)
+        if self.recorder is not None:
+            self.recorder.on_gain(gain)
+
+    '''
+    Remove every live agent whose score is above the cap, the same rule
+    update_scores applies with kill=True, through the graph's live mask
+    @param kill_score_cap: One cap for everyone, an array of caps by
+                           position, or a policy from kill, e.g.
+                           NeighborMax() for a cutoff relative to neighbors
+    @return: The ids of the removed nodes
+    '''
+    def kill(self, kill_score_cap=100):
+        prof = profiling.active
+        if prof is not None:
+            start = prof.start()
+        caps = kill_caps(kill_score_cap, self)
+        dead = np.flatnonzero(self.graph.live & (self.score > caps))
+        if self.recorder is not None:
+            self.recorder.on_kill(dead)
+        self.graph.remove_positions(dead)
+        if len(dead):
+            self.n_live -= len(dead)
+            self.n_zero -= int(np.count_nonzero(self.coop_prob[dead] == 0))
+            self.n_one -= int(np.count_nonzero(self.coop_prob[dead] == 1))
+            self._absorbing = None
+        removed = [self.nodes[i] for i in dead]
+        if prof is not None:
+            prof.stop('kill', start)
+            prof.count('killed', len(dead))
+        if self.compact_threshold is not None and len(self) \
+                and 1 - self.n_live / len(self) >= self.compact_threshold:
+            self.compact()
+        return removed
+
+    # Kill every agent scoring above factor times its neighbors' mean
+    def kill_relative(self, factor=1.0):
+        return self.kill(NeighborMean(factor))
+
+    '''
+    Bring agents back into dead positions. Their edges to live
+    neighbors come back with them.
+    @param positions: Dead positions of the current snapshot
+    @param coop_prob, score: Values for the newborns, scalars or arrays
+    @return: The ids of the new agents
+    '''
+    def birth(self, positions, coop_prob, score=0):
+        born = np.unique(np.asarray(positions, dtype=np.intp))
+        if self.graph.live[born].any():
+            raise ValueError("Agents can only be born into dead positions")
+        self.coop_prob[born] = coop_prob
+        self.score[born] = score
+        self.graph.add_positions(born)
+        self.n_live += len(born)
+        self.n_zero += int(np.count_nonzero(self.coop_prob[born] == 0))
+        self.n_one += int(np.count_nonzero(self.coop_prob[born] == 1))
+        self._absorbing = None
+        if self.recorder is not None:
+            self.recorder.on_birth(born)
+        return [self.nodes[i] for i in born]
+
+    '''
+    Drop the dead positions for good, so rounds and kills only visit
+    live agents. The engine moves to a new snapshot, and an agent
+    table sharing the engine's columns is replaced by one for the new
+    snapshot. Dead agents can no longer be born again.
+    Edges keep their order, so results do not change.
+    @return: (nodes, edges), the old positions and edge ids of the new
+             ones, to remap anything else kept per position or per edge
+    '''
+    def compact(self):
+        graph, nodes, edges = self.graph.compacted()
+        table = AgentTable(graph.node_ids, self.score[nodes], self.coop_prob[nodes])
+        for tag, old in list(graph.graph.items()):
+            if isinstance(old, AgentTable) and old.score is self.score:
+                graph.graph[tag] = table
+        self.graph = graph
+        self.coop_prob = table.coop_prob
+        self.score = table.score
+        self.count_states()
+        if self.recorder is not None:
+            self.recorder.attach(self)
+        return nodes, edges
+
+    '''
+    Play every edge once, or only the edges touching some nodes
+    @param takeover: Whether losers move toward the winner's coop_prob.
+                     Takeovers are applied in edge order, so an edge
+                     sees every takeover made by the edges before it.
+    @param rng: A numpy Generator, or anything with a random(size)
+                method. Defaults to the global numpy.random state used
+                by Node.strategy. update_scores given the same rng plays
+                the same round.
+    @param nodes: Optional node bunch. Only edges incident to these nodes
+                  are played, in the order update_scores(G, n_bunch)
+                  plays them, and no other edge is visited.
+    @return: (self_choices, opponent_choices) boolean arrays per edge.
+             Rounds played by multiedges mode return them per distinct
+             edge, as counts of cooperations for 'binomial'.
+    '''
+    def play_round(self, takeover=True, rng=None, nodes=None):
+        if rng is None:
+            rng = np.random
+        # Takeovers need every game in order, so they keep the full sweep
+        if nodes is None and not takeover and self.multiedges != 'expand':
+            return self._play_multiedges(rng)
+        if nodes is None:
+            src, dst = self.graph.live_edges()
+        else:
+            src, dst = self.graph.incident_edges(self.graph.positions(nodes))
+        return self.play_edges(src, dst, takeover, rng)
+
+    '''
+    Play a given sequence of games, in order
+    @param src, dst: Position arrays, one entry per game. src is the
+                     player whose choice is drawn second, as in
+                     Node.update_score. Edges may repeat.
+    @param edges: Edge id of each game, as sampled by the schedules.
+                  Unused here, for engines that keep state per edge.
+    @return: (self_choices, opponent_choices) boolean arrays per game
+    '''
+    def play_edges(self, src, dst, takeover=True, rng=None, edges=None):
+        if rng is None:
+            rng = np.random
+        prof = profiling.active
+        if prof is not None:
+            start = prof.start()
+        draws = rng.random(2 * len(src)).reshape(-1, 2)
+        opp_draws = draws[:, 0]
+        self_draws = draws[:, 1]
+        # Once absorbing no takeover can happen, so the games need no order
+        if takeover and not self.is_absorbing():
+            self_choice, opp_choice = self._play_sequential(src, dst, self_draws, opp_draws)
+        else:
+            self_choice = self_draws < self.coop_prob[src]
+            opp_choice = opp_draws < self.coop_prob[dst]
+        self.add_payoffs(src, dst, self_choice, opp_choice)
+        if prof is not None:
+            prof.played(start, len(src), 2 * len(src),
+                        self.count_takeovers(self_choice, opp_choice) if takeover else 0)
+        return self_choice, opp_choice
+
+    # Games whose outcome makes someone lose, i.e. takeovers when on
+    def count_takeovers(self, self_choice, opp_choice):
+        return int(np.count_nonzero(self.game.loser[self_choice.view(np.int8), opp_choice.view(np.int8)]))
+
+    '''
+    Play each distinct live edge once for all its parallel edges
+    @return: Per distinct edge, the choices of its one game ('weighted')
+             or the number of games each side cooperated in ('binomial')
+    '''
+    def _play_multiedges(self, rng):
+        prof = profiling.active
+        if prof is not None:
+            start = prof.start()
+        src, dst, multiplicity = self.graph.weighted_edges()
+        if self.multiedges == 'weighted':
+            draws = rng.random(2 * len(src)).reshape(-1, 2)
+            self_choice = draws[:, 1] < self.coop_prob[src]
+            opp_choice = draws[:, 0] < self.coop_prob[dst]
+            self_pay = multiplicity * self.payoffs[self_choice.view(np.int8), opp_choice.view(np.int8)]
+            opp_pay = multiplicity * self.payoffs[opp_choice.view(np.int8), self_choice.view(np.int8)]
+            self._add_pay(src, dst, self_pay, opp_pay)
+            if prof is not None:
+                prof.played(start, int(multiplicity.sum()), 2 * len(src))
+            return self_choice, opp_choice
+        n_self = rng.binomial(multiplicity, self.coop_prob[src])
+        n_opp = rng.binomial(multiplicity, self.coop_prob[dst])
+        # Games where both cooperate: which n_self of the games src
+        # cooperates in is uniform, so the overlap is hypergeometric.
+        # RandomState needs nsample >= 1, hence the where.
+        both = np.where(n_self > 0, rng.hypergeometric(
+            n_opp, multiplicity - n_opp, np.maximum(n_self, 1)), 0)
+        # Games by (self choice, opponent choice): DD, DC, CD, CC
+        counts = np.stack([
+            multiplicity - n_self - n_opp + both, n_opp - both, n_self - both, both], axis=1)
+        self._add_pay(src, dst, counts @ self.payoffs.ravel(), counts @ self.payoffs.T.ravel())
+        if prof is not None:
+            prof.played(start, int(multiplicity.sum()), 3 * len(src))
+        return n_self, n_opp
+
+    def add_payoffs(self, src, dst, self_choice, opp_choice):
+        self_pay = self.payoffs[self_choice.view(np.int8), opp_choice.view(np.int8)]
+        opp_pay = self.payoffs[opp_choice.view(np.int8), self_choice.view(np.int8)]
+        self._add_pay(src, dst, self_pay, opp_pay)
+
+    def _add_pay(self, src, dst, self_pay, opp_pay):
+        n = len(self)
+        self.score += np.bincount(src, weights=self_pay, minlength=n)
+        self.score += np.bincount(dst, weights=opp_pay, minlength=n)
+        if self.recorder is not None:
+            self.recorder.on_payoffs(src, dst, self_pay, opp_pay)
+
+    # Choices depend on coop_probs changed earlier in the same sweep, so
+    # this part walks the edges in order: in the compiled kernel when
+    # Numba is installed, otherwise over plain Python lists.
+    # The game's rules are looked up once, not per game.
+    def _play_sequential(self, src, dst, self_draws, opp_draws):
+        kernel = sequential_kernel()
+        if kernel is not None:
+            probs = self.coop_prob.copy()
+            self_choice, opp_choice, changed = run_kernel(
+                kernel, src, dst, self_draws, opp_draws, probs, self.game)
+            self._update_changed(changed, probs[changed])
+            self.coop_prob[:] = probs
+            return self_choice, opp_choice
+        loser = self.game.loser.tolist()
+        update = self.game.update_function()
+        probs = self.coop_prob.tolist()
+        src = src.tolist()
+        dst = dst.tolist()
+        self_draws = self_draws.tolist()
+        opp_draws = opp_draws.tolist()
+        n_edges = len(src)
+        self_choice = np.empty(n_edges, dtype=bool)
+        opp_choice = np.empty(n_edges, dtype=bool)
+        changed = []
+        for k in range(n_edges):
+            u = src[k]
+            v = dst[k]
+            opp = opp_draws[k] < probs[v]
+            me = self_draws[k] < probs[u]
+            lost = loser[me][opp]
+            if lost == 1:
+                probs[u] = update(probs[u], probs[v])
+                changed.append(u)
+            elif lost == -1:
+                probs[v] = update(probs[v], probs[u])
+                changed.append(v)
+            self_choice[k] = me
+            opp_choice[k] = opp
+        if changed:
+            changed = np.unique(changed)
+            self._update_changed(changed, np.array([probs[i] for i in changed]))
+        self.coop_prob[:] = probs
+        return self_choice, opp_choice
+
+    # Counts and recorder for takeovers, before coop_prob is overwritten
+    def _update_changed(self, changed, new):
+        if len(changed) == 0:
+            return
+        old = self.coop_prob[changed]
+        self.n_zero += int(np.count_nonzero(new == 0)) - int(np.count_nonzero(old == 0))
+        self.n_one += int(np.count_nonzero(new == 1)) - int(np.count_nonzero(old == 1))
+        self._absorbing = None
+        if self.recorder is not None:
+            self.recorder.on_change(changed, old, new)
+
+    '''
+    Snapshot everything a run needs to resume exactly
+    @param rng: The Generator driving the run, saved with the state
+    @return: A dict of array copies (and the rng state if given)
+    '''
+    def checkpoint(self, rng=None):
+        state = {
+            'coop_prob': self.coop_prob.copy(),
+            'score': self.score.copy(),
+            'live': self.graph.live.copy()}
+        if rng is not None:
+            state['rng'] = get_rng_state(rng)
+        return state
+
+    def restore(self, state, rng=None):
+        self.coop_prob[:] = state['coop_prob']
+        self.score[:] = state['score']
+        self.graph.set_live(state['live'])
+        self.count_states()
+        if rng is not None and 'rng' in state:
+            set_rng_state(rng, state['rng'])
+        if self.recorder is not None:
+            self.recorder.attach(self)
+        return self
+
+    # 0 once every agent is dead, as Recorder.mean_coop_prob
+    def mean_coop_prob(self):
+        live = self.graph.live
+        if not live.any():
+            return 0.0
+        return np.mean(self.coop_prob[live])
@@ -0,0 +1,68 @@
+'''
+Description:
+*   Frame pipeline for animating a simulation. The node positions and
+    edges never change, so a frame is captured as just the node state
+    of one step: which agents are alive and their scores.
+*   Frames are rendered to images by a process pool. Every worker gets
+    a GraphRenderer once, keeps it and its Kaleido process between
+    frames, and sends back the decoded image. The images are
+    streamed in order into one incremental GIF/MP4 writer, so nothing
+    but the animation itself is written to disk.
+'''
+from os import makedirs
+from os.path import dirname
+from save import GraphRenderer
+from pool import run_tasks
+import profiling
+
+WIDTH = 1024
+HEIGHT = 768
+
+
+# One frame: the live mask and scores of every snapshot position
+def capture_frame(engine):
+    return engine.graph.live.copy(), engine.score.copy()
+
+
+# This process's renderer and image size, set by _init_worker
+_worker = {}
+
+
+def _init_worker(renderer, width, height):
+    _worker['renderer'] = renderer
+    _worker['size'] = (width, height)
+
+
+def _render_frame(frame):
+    live, scores = frame
+    return _worker['renderer'].image(live, scores, *_worker['size'])
+
+
+'''
+Render frames and write them as an animation
+@param G: The networkx graph holding the node positions
+@param snapshot: The CompactGraph the frames were captured from
+@param frames: Frames from capture_frame, in order
+@param path: Output file. The extension picks the format, e.g. .gif
+             or .mp4 (MP4 needs imageio-ffmpeg).
+@param workers: Worker processes. None uses every core, 1 renders inline.
+@param writer_kwargs: Passed to imageio.get_writer, e.g. fps=10
+@return: The number of frames written
+'''
+def save_animation(G, snapshot, frames, path, workers=None, width=WIDTH, height=HEIGHT, **writer_kwargs):
+    import imageio.v2 as imageio
+    prof = profiling.active
+    if prof is not None:
+        start = prof.start()
+    if dirname(path):
+        makedirs(dirname(path), exist_ok=True)
+    init_args = (GraphRenderer.from_graph(G, snapshot), width, height)
+    written = 0
+    with imageio.get_writer(path, mode='I', **writer_kwargs) as writer:
+        for image in run_tasks(_render_frame, frames, _init_worker, init_args, workers):
+            writer.append_data(image)
+            written += 1
+    if prof is not None:
+        prof.stop('plot', start)
+        prof.count('frames', written)
+    return written
@@ -0,0 +1,70 @@
+'''
+Description:
+*   GameSpec holds the rules of a game as lookup tables: the payoff
+    matrix, who is taken over after each outcome, and how a takeover
+    moves the loser's coop_prob. The engines read the tables once per
+    round, so changing the rules costs nothing per game.
+*   The defaults are the rules of Node: years assigned of 3 (sucker),
+    2 (punishment), 1 (reward) and 0 (temptation), the player given
+    more years is taken over, and moves 0.1 toward the winner.
+'''
+import numpy as np
+from node import Node
+
+UPDATE_RULES = ['step', 'copy']
+
+
+# Payoff lookup indexed [own choice][opponent choice], 1 = cooperate.
+# Taken from a default Node so the engine scores exactly like the agents.
+def payoff_table(node=None):
+    if node is None:
+        node = Node(score=0, coop_prob=0)
+    return np.array([
+        [node.punishment, node.temptation],
+        [node.sucker, node.reward]], dtype=np.float64)
+
+
+# Same arithmetic as Node.taken_over_by, on plain floats
+def take_over(current_strategy, new_strategy, increment=0.1):
+    if current_strategy > new_strategy:
+        current_strategy -= increment
+    else:
+        current_strategy += increment
+    if current_strategy < 0:    current_strategy = float(0)
+    if current_strategy > 1:    current_strategy = float(1)
+    return current_strategy
+
+
+class GameSpec():
+
+    '''
+    @param payoffs: 2x2 years assigned, indexed [own choice][opponent
+                    choice] with 1 = cooperate (default: payoff_table())
+    @param takeover_step: How far the 'step' rule moves the loser
+    @param update_rule: 'step' moves the loser's coop_prob toward the
+                        winner's by takeover_step, as Node.taken_over_by.
+                        'copy' gives the loser the winner's coop_prob.
+    '''
+    def __init__(self, payoffs=None, takeover_step=0.1, update_rule='step'):
+        self.payoffs = payoff_table() if payoffs is None else np.array(payoffs, dtype=np.float64)
+        if self.payoffs.shape != (2, 2):
+            raise ValueError(f"Payoffs must be 2x2, got shape {self.payoffs.shape}")
+        if update_rule not in UPDATE_RULES:
+            raise ValueError(f"Unknown update rule {update_rule!r}, expected one of {UPDATE_RULES}")
+        self.takeover_step = takeover_step
+        self.update_rule = update_rule
+        # Who is taken over, indexed [own choice][opponent choice]:
+        # 1 for self, -1 for the opponent, 0 for nobody. The player given
+        # more years loses, so the defaults match Node.update_score.
+        self.loser = np.sign(self.payoffs - self.payoffs.T).astype(np.int8)
+
+    # The loser's new coop_prob, as a plain function for the engine loops
+    def update_function(self):
+        if self.update_rule == 'copy':
+            return lambda current, new: new
+        step = self.takeover_step
+        return lambda current, new: take_over(current, new, step)
+
+    def __repr__(self):
+        return (f"GameSpec(payoffs={self.payoffs.tolist()}, "
+                f"takeover_step={self.takeover_step}, update_rule={self.update_rule!r})")
@@ -1,10 +1,12 @@
 # Author: Jacob Collins
 
-from node import Node
-from networkx import set_node_attributes, neighbors, get_node_attributes
+import numpy as np
+from agents import AgentTable
 from numpy.random import choice
 from collections.abc import Iterable
-#import networkx as nx
+import profiling
+# networkx is only imported by the functions that write node attributes,
+# so the simulation core loads without it
 
 
 '''
@@ -14,87 +16,128 @@ Function for generating a network of agents
 @param coop_vals: list of possible starting coop_probs for prisoners
 @param coop_odds: probability of a node having the coop_prob assosciated with
                   the corresponding index in coop_vals
+@param rng: numpy Generator to draw coop_probs from (default: numpy.random)
 Agents are initialized with randomized scores and coop probs based on 
   our defined probability distribution and matching coop_prob list
-@return G: The input graph, with agents in G.node[u][tag]
+@return G: The input graph, with an AgentTable in G.graph[tag]
 '''
 def add_rand_agents(
     G, 
     init_score=0, 
     coop_vals=[1, 0], 
     coop_odds=[0.5, 0.5],
-    tag='agent'):
-    attrs = {
-        u: Node(
-            id=u,
-            score=init_score, 
-            coop_prob=float(choice(
-                coop_vals,
-                1, 
-                p=coop_odds)))
-        for u in G.nodes()
-    }
-    set_node_attributes(G, attrs, tag)
+    tag='agent',
+    rng=None):
+    prof = profiling.active
+    if prof is not None:
+        start = prof.start()
+    nodes = list(G.nodes())
+    rand_choice = choice if rng is None else rng.choice
+    coop_probs = rand_choice(coop_vals, len(nodes), p=coop_odds)
+    G.graph[tag] = AgentTable(nodes, init_score, coop_probs)
+    if prof is not None:
+        prof.stop('setup', start)
     return G
 
  
 # Agents are initialized with individual predefined scores and coop_probs
-# @return G: The input graph, with agents in G.node[u][tag]
+# @return G: The input graph, with an AgentTable in G.graph[tag]
 def add_agents(
     G, 
     score_vals,
     coop_vals, 
     tag='agent'):
-    num_nodes = len(G.nodes())
+    prof = profiling.active
+    if prof is not None:
+        start = prof.start()
+    nodes = list(G.nodes())
+    num_nodes = len(nodes)
     if not isinstance(score_vals, Iterable):
         score_vals = [score_vals] * num_nodes
     if not isinstance(coop_vals, Iterable):
         coop_vals = [coop_vals] * num_nodes
-    attrs = {
-        u: Node(
-            id=u,
-            score=score_vals[i], 
-            coop_prob=coop_vals[i]) 
-        for i, u in enumerate(G.nodes())}
-    set_node_attributes(G, attrs, tag)
+    G.graph[tag] = AgentTable(nodes, score_vals[:num_nodes], coop_vals[:num_nodes])
+    if prof is not None:
+        prof.stop('setup', start)
     return G
 
 
+def get_agent_table(G, tag='agent'):
+    return G.graph[tag]
+
+
+# Returns a Node-compatible view of u's row in the agent table
 def get_agent(G, u, tag='agent'):
-    return G.nodes[u][tag]
+    return G.graph[tag].view(u)
     
 
-def update_score_attribute(G, score_tag='score', strategy_tag='strategy'):
-    scores = {u: get_agent(G, u).get_score() for u in G}
-    strategies = {u: get_agent(G, u).get_coop_prob() for u in G}
+# Copies scores and strategies into networkx node attributes,
+# for code that reads them with get_node_attributes
+def update_score_attribute(G, score_tag='score', strategy_tag='strategy', agent_tag='agent'):
+    from networkx import set_node_attributes
+    prof = profiling.active
+    if prof is not None:
+        start = prof.start()
+    table = get_agent_table(G, agent_tag)
+    nodes = list(G.nodes())
+    rows = table.positions(nodes)
+    scores = dict(zip(nodes, table.score[rows].tolist()))
+    strategies = dict(zip(nodes, table.coop_prob[rows].tolist()))
     set_node_attributes(G, scores, score_tag)
     set_node_attributes(G, strategies, strategy_tag)
+    if prof is not None:
+        prof.stop('sync', start)
     
 
+# Plays one round on G. If n_bunch is given, only the edges incident
+# to those nodes are played, so a round can update part of the graph.
 def update_scores(
     G, 
     n_bunch=None, 
     kill=False,
     kill_score_cap = 100,
     takeover=True,
+    sync_attributes=False,
+    rng=None,
     agent_tag='agent', 
     score_tag='score',
     strategy_tag='strategy'):
-    S = G.subgraph(n_bunch).copy()
+    table = get_agent_table(G, agent_tag)
+    prof = profiling.active
     if kill:
-        nodes_to_remove = [[u, G.nodes[u][agent_tag]] for u in G.nodes() if G.nodes[u][score_tag] > kill_score_cap]
-        for u in nodes_to_remove:
-            G.remove_node(u[0])
+        if prof is not None:
+            start = prof.start()
+        # One vectorized pass over the score column, one removal call
+        nodes = list(G.nodes())
+        dead = np.flatnonzero(table.score[table.positions(nodes)] > kill_score_cap)
+        G.remove_nodes_from([nodes[i] for i in dead])
+        if prof is not None:
+            prof.stop('kill', start)
+            prof.count('killed', len(dead))
+    if prof is not None:
+        start = prof.start()
 
-    for u, v in G.edges():
+    # With an rng, every choice of the round comes from one batched draw,
+    # in the same order the engine uses: (opponent, self) per edge
+    edges = list(G.edges(n_bunch))
+    if rng is None:
+        draws = [(None, None)] * len(edges)
+    else:
+        draws = rng.random((len(edges), 2)).tolist()
+    for (u, v), edge_draws in zip(edges, draws):
         # Get u and v coop prob, have them play, whoever loses adjust their strategy
-        G.nodes[u][agent_tag].update_score(G.nodes[v][agent_tag], takeover=takeover)
+        table.view(u).update_score(table.view(v), takeover=takeover, draws=edge_draws)
+    if prof is not None:
+        # Takeovers are only counted by the engines
+        prof.played(start, len(edges), 2 * len(edges))
     
-    update_score_attribute(G)
+    if sync_attributes:
+        update_score_attribute(G, score_tag, strategy_tag, agent_tag)
     return []
 
 
 def verify_agents(G):
+    from networkx import get_node_attributes
     print([c for c in get_node_attributes(G)])
     
     
@@ -102,11 +145,13 @@ def run_time_steps(G, n):
     return
 
 def set_node_positions(G, pos):
+    from networkx import set_node_attributes
     cleaned_pos = {u: tuple(pos[u]) for u in list(pos.keys())}
     set_node_attributes(G, cleaned_pos, 'pos')
     return G
 
 
 def keep_node_positions(G, pos_dict):
+    from networkx import set_node_attributes
     set_node_attributes(G, pos_dict, 'pos')
     return G
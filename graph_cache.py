@@ -0,0 +1,80 @@
+'''
+Description:
+*   Cache of generated graphs, keyed on (generator, params, seed).
+    Each graph is built once with networkx, snapshotted as a
+    CompactGraph and saved as .npy files:
+        cache/graphs/<generator>_<key>/indptr.npy
+        ...
+*   Later calls memory-map the saved arrays, and a small LRU keeps the
+    loaded snapshots in memory. Memory-mapped snapshots pickle as their
+    path, so pool workers map the same files instead of getting copies.
+*   Random generators called with seed=None are built fresh every time,
+    since there is nothing to key them on.
+'''
+from functools import lru_cache
+from hashlib import sha1
+from inspect import signature
+from os import rename, getpid
+from os.path import join, isdir
+from shutil import rmtree
+import json
+from compact import CompactGraph
+
+CACHE_DIR = join('cache', 'graphs')
+
+
+def _resolve(generator):
+    if callable(generator):
+        return generator
+    import networkx as nx
+    return getattr(nx, generator)
+
+
+def _takes_seed(fn):
+    try:
+        return 'seed' in signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+@lru_cache(maxsize=32)
+def _load(path):
+    return CompactGraph.load(path)
+
+
+'''
+Get a generated graph from the cache, building it on a miss
+@param generator: A networkx generator, by name (e.g. 'gnp_random_graph')
+                  or as a function
+@param args, kwargs: Passed to the generator. They must be JSON
+                     serializable, since they make up the key.
+@param seed: Passed to the generator if it takes a seed
+@param cache_dir: Directory holding the saved graphs
+@return: A fresh CompactGraph. Its arrays are shared with every other
+         copy of the same graph, its live mask and agents are its own.
+'''
+def cached_graph(generator, *args, seed=None, cache_dir=CACHE_DIR, **kwargs):
+    fn = _resolve(generator)
+    if _takes_seed(fn):
+        if seed is None:
+            return CompactGraph.from_networkx(fn(*args, **kwargs))
+        kwargs['seed'] = seed
+    name = f'{fn.__module__}.{fn.__qualname__}'
+    key = json.dumps([name, args, kwargs], sort_keys=True)
+    path = join(cache_dir, f'{fn.__name__}_{sha1(key.encode()).hexdigest()[:16]}')
+    if not isdir(path):
+        tmp_dir = f'{path}.{getpid()}.tmp'
+        CompactGraph.from_networkx(fn(*args, **kwargs)).save(tmp_dir)
+        with open(join(tmp_dir, 'key.json'), 'w') as f:
+            f.write(key)
+        # Readers only ever see complete graphs. If another process
+        # saved the same graph first, its copy is kept.
+        try:
+            rename(tmp_dir, path)
+        except OSError:
+            rmtree(tmp_dir)
+    return _load(path).copy()
+
+
+def clear_memory_cache():
+    _load.cache_clear()
@@ -9,6 +9,59 @@ Sources:
 '''
 import numpy as np
 
+# Returns a numpy Generator. Accepts a seed, a SeedSequence or a Generator,
+# which is passed through so drivers can share one stream.
+def make_rng(seed=None):
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+# The bit generator state is a plain dict, so it can be saved
+# alongside results and restored to resume a run exactly
+def get_rng_state(rng):
+    return rng.bit_generator.state
+
+def set_rng_state(rng, state):
+    rng.bit_generator.state = state
+    return rng
+
+# Draws discarded at a time when a generator cannot jump ahead
+SKIP_CHUNK = 2**16
+# Bit generators whose advance(n) skips exactly n uniform draws. Others
+# count differently, e.g. Philox advances in blocks of four words.
+ADVANCE_BY_DRAW = tuple(
+    getattr(np.random, name) for name in ('PCG64', 'PCG64DXSM') if hasattr(np.random, name))
+
+# Moves rng past n uniform draws, as if rng.random(n) had been called.
+# PCG64 jumps ahead in O(1), other generators draw and discard in
+# chunks, so memory stays bounded for any n.
+def skip_draws(rng, n):
+    if isinstance(getattr(rng, 'bit_generator', None), ADVANCE_BY_DRAW):
+        rng.bit_generator.advance(n)
+        return
+    while n > 0:
+        chunk = min(n, SKIP_CHUNK)
+        rng.random(chunk)
+        n -= chunk
+
+'''
+Check skip_draws against rng.random(n) for every bit generator numpy
+ships, and the legacy RandomState
+@raise RuntimeError: If a skipped generator ends up elsewhere
+'''
+def check_skip_draws(n=3 * SKIP_CHUNK + 5, seed=0):
+    generators = {
+        name: lambda name=name: np.random.Generator(getattr(np.random, name)(seed))
+        for name in ('MT19937', 'PCG64', 'PCG64DXSM', 'Philox', 'SFC64')
+        if hasattr(np.random, name)}
+    generators['RandomState'] = lambda: np.random.RandomState(seed)
+    for name, make in generators.items():
+        skipped, drawn = make(), make()
+        skip_draws(skipped, n)
+        drawn.random(n)
+        if skipped.random(4).tolist() != drawn.random(4).tolist():
+            raise RuntimeError(f"skip_draws does not match random(n) for {name}")
+
 def match_list_lengths(y_lists):
     max_len = max(len(y_list) for y_list in y_lists)
     for y_list in y_lists:
@@ -81,4 +134,9 @@ def printProgressBar (
     print(f'\r{prefix} |{bar}| {percent}% {suffix}', end = printEnd)
     # Print New Line on Complete
     if iteration == total: 
-        print()
\ No newline at end of file
+        print()
+
+
+if __name__ == '__main__':
+    check_skip_draws()
+    print("skip_draws matches random(n) for every bit generator")
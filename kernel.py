@@ -0,0 +1,99 @@
+'''
+Description:
+*   Compiled kernel for the in-order takeover sweep. A takeover on one
+    edge changes a coop_prob that later edges of the same sweep read,
+    so the sweep is a loop, and this module compiles that loop with
+    Numba when it is installed.
+*   The kernel runs Node.update_score and Node.taken_over_by on plain
+    arrays: the same comparisons with pre-drawn uniforms, the same
+    float64 arithmetic and clamping, in the same edge order, so results
+    match the reference path bit for bit.
+*   Numba is optional and only imported on first use, so the core still
+    loads quickly. Without it sequential_kernel() returns None and the
+    engine keeps its pure-Python loop.
+'''
+import numpy as np
+
+# Set to False to always use the pure-Python loop
+ENABLED = True
+_compiled = {}
+
+
+'''
+Play a sequence of games in order, with takeovers
+@param src, dst: intp position arrays, one entry per game
+@param self_draws, opp_draws: The uniforms of each game's two choices
+@param probs: float64 coop_probs, updated in place
+@param loser: int8 GameSpec.loser table
+@param copy: Whether the loser copies the winner (GameSpec 'copy' rule)
+             instead of stepping toward it
+@param step: GameSpec.takeover_step
+@param self_choice, opp_choice: bool output arrays, one entry per game
+@param changed: bool array by position, set for every agent taken over
+'''
+def sequential_round(src, dst, self_draws, opp_draws, probs, loser, copy, step,
+                     self_choice, opp_choice, changed):
+    for k in range(len(src)):
+        u = src[k]
+        v = dst[k]
+        opp = opp_draws[k] < probs[v]
+        me = self_draws[k] < probs[u]
+        lost = loser[int(me), int(opp)]
+        if lost != 0:
+            if lost == 1:
+                a = u
+                b = v
+            else:
+                a = v
+                b = u
+            if copy:
+                probs[a] = probs[b]
+            else:
+                # take_over, as Node.taken_over_by
+                current = probs[a]
+                if current > probs[b]:
+                    current -= step
+                else:
+                    current += step
+                if current < 0:
+                    current = 0.0
+                if current > 1:
+                    current = 1.0
+                probs[a] = current
+            changed[a] = True
+        self_choice[k] = me
+        opp_choice[k] = opp
+
+
+# sequential_round compiled with Numba, or None if it is not installed
+# or ENABLED is off. Compiled once per process, cached on disk.
+def sequential_kernel():
+    if not ENABLED:
+        return None
+    if 'sequential_round' not in _compiled:
+        try:
+            from numba import njit
+        except ImportError:
+            _compiled['sequential_round'] = None
+        else:
+            _compiled['sequential_round'] = njit(cache=True, nogil=True)(sequential_round)
+    return _compiled['sequential_round']
+
+
+'''
+Run a kernel on numpy arrays, allocating the outputs
+@param kernel: sequential_round or its compiled version
+@return: (self_choice, opp_choice, changed) where changed holds the
+         positions taken over, in order
+'''
+def run_kernel(kernel, src, dst, self_draws, opp_draws, probs, game):
+    n_edges = len(src)
+    self_choice = np.empty(n_edges, dtype=bool)
+    opp_choice = np.empty(n_edges, dtype=bool)
+    changed = np.zeros(len(probs), dtype=bool)
+    kernel(
+        np.ascontiguousarray(src, dtype=np.intp), np.ascontiguousarray(dst, dtype=np.intp),
+        np.ascontiguousarray(self_draws), np.ascontiguousarray(opp_draws), probs,
+        game.loser, game.update_rule == 'copy', float(game.takeover_step),
+        self_choice, opp_choice, changed)
+    return self_choice, opp_choice, np.flatnonzero(changed)
@@ -0,0 +1,150 @@
+'''
+Description:
+*   Kill policies for RoundEngine.kill. A policy turns the current scores
+    into a cap per agent, and every live agent scoring above its cap is
+    removed, as with the global kill_score_cap of update_scores.
+*   The neighbor-relative caps are computed for every agent at once from
+    the live entries of the snapshot's CSR rows: a mean is one bincount,
+    and a max or percentile is a segment reduction, each a single pass
+    with no per-node Python loop. Agents with no live neighbor get no cap.
+*   Every policy sees the neighbors of G[u]: an agent with a self-loop
+    is its own neighbor once, and a neighbor joined by parallel edges
+    counts once per edge.
+'''
+import numpy as np
+
+# Largest padded matrix NeighborPercentile sorts, relative to the number
+# of live entries
+PAD_LIMIT = 4
+
+
+# The same cap for everyone, as update_scores(kill=True)
+class ScoreCap():
+
+    def __init__(self, cap=100):
+        self.cap = cap
+
+    def caps(self, engine):
+        return np.full(len(engine), float(self.cap))
+
+    def __repr__(self):
+        return f"ScoreCap({self.cap})"
+
+
+'''
+Live neighbors' scores, grouped by row in CSR order
+@return: (rows, values, counts): the row of each live entry, the score
+         of its neighbor, and the number of live entries per row
+'''
+def _neighbor_scores(engine):
+    graph = engine.graph
+    n = len(graph)
+    rows = np.repeat(np.arange(n, dtype=np.intp), np.diff(graph.indptr))
+    live = graph.live[rows] & graph.live[graph.indices]
+    rows = rows[live]
+    values = engine.score[graph.indices[live]]
+    return rows, values, np.bincount(rows, minlength=n)
+
+
+# factor times the mean score of the live neighbors
+class NeighborMean():
+
+    def __init__(self, factor=1.0):
+        self.factor = factor
+
+    def caps(self, engine):
+        rows, values, counts = _neighbor_scores(engine)
+        sums = np.bincount(rows, weights=values, minlength=len(engine))
+        caps = np.full(len(engine), np.inf)
+        np.divide(self.factor * sums, counts, out=caps, where=counts > 0)
+        return caps
+
+    def __repr__(self):
+        return f"NeighborMean({self.factor})"
+
+
+# factor times the best score among the live neighbors
+class NeighborMax():
+
+    def __init__(self, factor=1.0):
+        self.factor = factor
+
+    def caps(self, engine):
+        rows, values, counts = _neighbor_scores(engine)
+        caps = np.full(len(engine), np.inf)
+        if len(values):
+            # Rows are contiguous in CSR order, so each reduces in place
+            starts = np.cumsum(counts) - counts
+            has = counts > 0
+            caps[has] = self.factor * np.maximum.reduceat(values, starts[has])
+        return caps
+
+    def __repr__(self):
+        return f"NeighborMax({self.factor})"
+
+
+'''
+factor times the q-th percentile of the live neighbors' scores, with
+numpy.percentile's linear interpolation
+@param q: Percentile in [0, 100]. 50 is the median, 100 the max.
+'''
+class NeighborPercentile():
+
+    def __init__(self, q, factor=1.0):
+        if not 0 <= q <= 100:
+            raise ValueError(f"Percentile must be in [0, 100], got {q}")
+        self.q = q
+        self.factor = factor
+
+    def caps(self, engine):
+        rows, values, counts = _neighbor_scores(engine)
+        caps = np.full(len(engine), np.inf)
+        has = counts > 0
+        if not has.any():
+            return caps
+        counts = counts[has]
+        rank = self.q / 100 * (counts - 1)
+        low = np.floor(rank).astype(np.intp)
+        high = np.minimum(low + 1, counts - 1)
+        width = counts.max()
+        if len(counts) * width <= PAD_LIMIT * len(values):
+            # Rows of similar length: pad them with inf into a matrix and
+            # sort along its rows, much faster than one long sort
+            padded = np.full((len(counts), width), np.inf)
+            starts = np.cumsum(counts) - counts
+            offsets = np.arange(len(values)) - np.repeat(starts, counts)
+            padded[np.repeat(np.arange(len(counts)), counts), offsets] = values
+            padded.sort(axis=1)
+            below = padded[np.arange(len(counts)), low]
+            above = padded[np.arange(len(counts)), high]
+        else:
+            # Skewed degrees: sort by score within each row in one lexsort
+            values = values[np.lexsort((values, rows))]
+            starts = np.cumsum(counts) - counts
+            below = values[starts + low]
+            above = values[starts + high]
+        caps[has] = self.factor * (below + (above - below) * (rank - low))
+        return caps
+
+    def __repr__(self):
+        return f"NeighborPercentile({self.q}, {self.factor})"
+
+
+# Policies by name, for configs and the command line
+POLICIES = {
+    'cap': ScoreCap,
+    'mean': NeighborMean,
+    'max': NeighborMax,
+    'percentile': NeighborPercentile,
+}
+
+
+'''
+Caps for a kill, from whatever RoundEngine.kill was given
+@param policy: A policy object, one cap for everyone, or an array of
+               caps by position
+'''
+def kill_caps(policy, engine):
+    if hasattr(policy, 'caps'):
+        return policy.caps(engine)
+    return policy
@@ -11,12 +11,21 @@ Sources:
 '''
 
 import networkx as nx
-from numpy import floor, mean
+from numpy import floor
 from graph import *
+from engine import RoundEngine
+from compact import CompactGraph
+from graph_cache import cached_graph
+from frames import capture_frame, save_animation
+from sweep import run_proportion_sweep, load_proportion_sweep, PROPORTIONS
+from store import ResultsStore
+from schedule import SynchronousSchedule
+from recorder import Recorder
 from save import *
 from helpers import *
 
-def example():
+def example(seed=None):
+    rng = make_rng(seed)
     n = 6
     G1 = nx.complete_graph(n)
     coop_prop = 0.9
@@ -27,7 +36,7 @@ def example():
         print(f'{u}: {get_agent(G1, u)}')
     print("")
     # update_scores(G1, [1, 2]) # Updates the scores of nodes 1 and 2
-    update_scores(G1) # Updates the scores
+    update_scores(G1, sync_attributes=True, rng=rng) # Updates the scores
     for u in G1.nodes():
         print(f'Data of Agent {u}: {get_agent(G1, u)}') # Agent class is returned (Shows __repr__)
     print(f'Scores (nx dict): {nx.get_node_attributes(G1, "score")}') # Showing that score is also saved in the node itself
@@ -36,11 +45,11 @@ def example():
     
     print("Probabilistic Strategies")
     G2 = nx.complete_graph(n)
-    add_rand_agents(G2, 0, [0.8, 0.2], [0.5, 0.5])
+    add_rand_agents(G2, 0, [0.8, 0.2], [0.5, 0.5], rng=rng)
     for u in G2.nodes():
         print(f'{u}: {get_agent(G2, u)}')
     print("")
-    update_scores(G2)
+    update_scores(G2, sync_attributes=True, rng=rng)
     for u in G2.nodes():
         print(f'Data of Agent {u}: {get_agent(G2, u)}') # Agent class is returned (Shows __repr__)
     print(f'Scores (nx dict): {nx.get_node_attributes(G2, "score")}') # Showing that score is also saved in the node itself
@@ -50,11 +59,12 @@ def example():
 # Generates a GIF of the simulation's time steps
 # 90% of prisoners have an 80% chance to cooperate
 # 10% of prisoners have a 20% chance to cooperate
-def generate_gif():
+def generate_gif(seed=None):
+    rng = make_rng(seed)
     n = 100
     # G = nx.complete_graph(n)
     G = nx.gnp_random_graph(n, 5/(n+5), seed=1)
-    add_rand_agents(G, 0.0, [0.8, 0.2], [0.9, 0.1])
+    add_rand_agents(G, 0.0, [0.8, 0.2], [0.9, 0.1], rng=rng)
     coop_prop = 0.5
     n_coop = int(floor(n*coop_prop))
     # add_agents(G, 0, [0.8]*n_coop + [0.2]*(n-n_coop))
@@ -62,72 +72,64 @@ def generate_gif():
     # pos = nx.spectral_layout(G)
     pos = nx.shell_layout(G)
     G = set_node_positions(G, pos)
-    pos_dict = get_node_attributes(G, 'pos')
-    update_score_attribute(G)
+    # Kills only mark the snapshot, G keeps every node and its position
+    C = CompactGraph.from_networkx(G)
+    engine = RoundEngine.from_graph(C)
     removed_nodes = []
+    frames = []
     for i in range(40):
-        removed_nodes += update_scores(G, kill=True, kill_score_cap=500)
-        G = keep_node_positions(G, pos_dict)
-        draw_graph(G, f'{i}_varying_prisoner_strat', 'gnp/test1', "Simulating the Prisoner's Dilemma")
+        removed_nodes += engine.kill(kill_score_cap=500)
+        engine.play_round(rng=rng)
+        frames.append(capture_frame(engine))
     print("Dead:")
     for u in removed_nodes:
-        print(u)
+        print(get_agent(C, u))
     print("Alive:")
-    for u in G.nodes():
-        print(G.nodes[u]['agent'])
-    save_gif('varying_prisoner_strat', dirname='gnp/test1')
+    for u in C.nodes():
+        print(get_agent(C, u))
+    save_animation(G, C, frames, 'graphs/gnp/test1/varying_prisoner_strat.gif')
     
-def test_proportions(G, n, dir_graph_name, graph_type):
+# store: optional ResultsStore to keep the numbers behind the figure,
+#        under label = (family, n, params) (default: (dir_graph_name, n, ''))
+# writer: optional FigureWriter to save the figures in the background
+# analytic: compute the expected years instead of simulating them
+# batched: simulate replicates in batches, with the same results
+# multiedges: how parallel edges of a multigraph are played. Each edge
+#             plays once per multiplicity by default ('expand'), as in
+#             update_scores; 'weighted' or 'binomial' are opt-in.
+def test_proportions(G, n, dir_graph_name, graph_type, seed=None, workers=None, store=None, label=None, writer=None, analytic=False, batched=True, multiedges='expand'):
     # G = nx.gnp_random_graph(n, 0.05)
     n_iter = 10
-    y_lists = [[], [], []]
-    x_list = [0.005 * i for i in range(4)] + [0.02 * i for i in range(1, 51)]
     print(f"Testing Proportions on {graph_type}")
-    for coop_prop in x_list:
-        coop_full_years = []
-        defect_full_years = []
-        printProgressBar(
-            iteration=0, 
-            total=n_iter, 
-            suffix=f"Starting Coop: {round(coop_prop*100,1)}%",
-            length=25)
-        for i in range(n_iter):
-            coop_full_years.append([])
-            defect_full_years.append([])
-            n_coop = int(floor(n*coop_prop))
-            add_agents(G, 0, [1.0]*n_coop + [0.0]*(n-n_coop))
-            for _ in range(20):
-                update_scores(G, takeover=False)
-            for u in G.nodes():
-                node = G.nodes[u]['agent']
-                if node.get_coop_prob() >= 0.5:
-                    coop_full_years[i].append(node.get_score())
-                else:
-                    defect_full_years[i].append(node.get_score())
-            coop_years = mean_across_lists(coop_full_years)
-            defect_years = mean_across_lists(defect_full_years)
-            printProgressBar(
-                iteration=i, 
-                total=n_iter, 
-                suffix=f"Starting Coop: {round(coop_prop*100,1)}%",
-                length=25)
-        # print(f'coop_prob: {mean(coop_prop)}')
-        # print(f'    defect_years: {mean(defect_years)}')
-        if len(defect_years) > 0:
-            y_lists[0].append(mean(defect_years))
-        else:
-            y_lists[0].append(0)
-        # print(f'    coop_years: {mean(coop_years)}')
-        if len(coop_years) > 0:
-            y_lists[1].append(mean(coop_years))
-        else:
-            y_lists[1].append(0)
-        y_lists[2].append((y_lists[0][len(y_lists[0])-1]+y_lists[1][len(y_lists[0])-1])/2)
+    [y_lists] = run_proportion_sweep(
+        [G],
+        n_iter=n_iter,
+        seed=seed,
+        workers=workers,
+        on_update=sweep_progress,
+        store=store,
+        labels=[label or (dir_graph_name, n, '')],
+        analytic=analytic,
+        batched=batched,
+        multiedges=multiedges)
+    plot_proportions(y_lists, dir_graph_name, graph_type, writer)
+
+
+# Redraws test_proportions' figures from a ResultsStore
+def replot_proportions(store, label, dir_graph_name, graph_type):
+    plot_proportions(load_proportion_sweep(store, label), dir_graph_name, graph_type)
+
+
+def sweep_progress(done, total, g, p, partial):
     printProgressBar(
-        iteration=n_iter, 
-        total=n_iter, 
-        suffix=f"Starting Coop: {round(coop_prop*100,1)}%",
+        iteration=done, 
+        total=total, 
+        suffix=f"Starting Coop: {round(PROPORTIONS[p]*100,1)}%",
         length=25)
+
+
+def plot_proportions(y_lists, dir_graph_name, graph_type, writer=None):
+    x_list = PROPORTIONS
     compareLines(
         x_list=x_list,
         y_lists=y_lists,
@@ -138,57 +140,80 @@ def test_proportions(G, n, dir_graph_name, graph_type):
         ],
         xlabel="Proportion of Cooperators",
         ylabel="Years Assigned",
-        name=f'proportions',
-        dirname=f'figs/test_proportions/{dir_graph_name}',
-        darktheme=False,
-        title=f"Years Assigned - {graph_type}",
-        subtitle="Average Years Assigned in Each Group"
-    )
-    compareLines(
-        x_list=x_list,
-        y_lists=y_lists,
-        y_labels=[
-            "Defectors",
-            "Cooperators",
-            "All Agents"
-        ],
-        xlabel="Proportion of Cooperators",
-        ylabel="Years Assigned",
-        name=f'dark_proportions',
-        darktheme=True,
+        themes={False: 'proportions', True: 'dark_proportions'},
         dirname=f'figs/test_proportions/{dir_graph_name}',
         title=f"Years Assigned - {graph_type}",
-        subtitle="Average Years Assigned in Each Group"
+        subtitle="Average Years Assigned in Each Group",
+        writer=writer
     )
 
-def test_takeover(G, n, dir_graph_name, graph_type):
-    prop_list = [(1/25) * i for i in range(26)] # 0.2, 0.4, ..., 1.0
+# schedule: how each time step is played (default: synchronous sweeps)
+# store, label, writer: as in test_proportions
+TAKEOVER_PROPORTIONS = [(1/25) * i for i in range(26)] # 0.04, 0.08, ..., 1.0
+
+def test_takeover(G, n, dir_graph_name, graph_type, seed=None, schedule=None, store=None, label=None, writer=None):
+    rng = make_rng(seed)
+    if schedule is None:
+        schedule = SynchronousSchedule()
+    prop_list = TAKEOVER_PROPORTIONS
     n_iter=40
-    x_list = range(n_iter)
     y_lists = []
+    family, _, params = label or (dir_graph_name, n, '')
     print(f"Testing Takeover on {graph_type}")
     for i, coop_prop in enumerate(prop_list):
-        y_lists.append([])
         n_coop = int(floor(n*coop_prop))
         add_agents(G, 0, [1.0]*n_coop + [0.0]*(n-n_coop))
+        engine = RoundEngine.from_graph(G)
+        recorder = Recorder(capacity=n_iter).attach(engine)
         printProgressBar(
             iteration=0, 
             total=n_iter, 
             suffix=f"Starting Coop: {round(coop_prop*100,1)}%",
             length=25)
         for j in range(n_iter):
-            y_lists[i].append(np.mean([node.get_coop_prob() for node in [G.nodes[u]['agent'] for u in G.nodes()]]))
-            update_scores(G)
+            recorder.record(j)
+            gain = schedule.absorbed_gain(engine) if engine.is_absorbing() else None
+            if gain is not None:
+                # Nothing but the scores can change any more, so the
+                # remaining steps are recorded and played in one go
+                recorder.record_absorbed(range(j + 1, n_iter), gain)
+                engine.fast_forward(n_iter - j, rng)
+                break
+            schedule.step(engine, rng=rng)
             printProgressBar(
                 iteration=j, 
                 total=n_iter, 
                 suffix=f"Starting Coop: {round(coop_prop*100,1)}%",
                 length=25)
+        y_lists.append(recorder.column('mean_coop_prob').tolist())
+        if store is not None:
+            series = recorder.series()
+            store.append(
+                family, n, params, coop_prop, 0, series[:, 0].astype(int),
+                **{name: series[:, c] for c, name in enumerate(recorder.columns) if c > 0})
+    if store is not None:
+        store.flush()
     printProgressBar(
         iteration=n_iter, 
         total=n_iter, 
         suffix=f"Starting Coop: {round(coop_prop*100,1)}%",
         length=25)
+    plot_takeover(y_lists, dir_graph_name, graph_type, writer)
+
+
+# Redraws test_takeover's figures from a ResultsStore
+def replot_takeover(store, label, dir_graph_name, graph_type):
+    family, n, params = label
+    rows = store.select(['coop_prop', 'step', 'mean_coop_prob'], family=family, n=n, params=params)
+    order = np.lexsort((rows['step'], rows['coop_prop']))
+    y_lists = [
+        rows['mean_coop_prob'][order][rows['coop_prop'][order] == coop_prop].tolist()
+        for coop_prop in np.unique(rows['coop_prop'])]
+    plot_takeover(y_lists, dir_graph_name, graph_type)
+
+
+def plot_takeover(y_lists, dir_graph_name, graph_type, writer=None):
+    x_list = range(len(y_lists[0]))
     compareLines(
         x_list=x_list,
         y_lists=y_lists,
@@ -197,91 +222,84 @@ def test_takeover(G, n, dir_graph_name, graph_type):
         ylabel="Mean Cooperation Probability",
         # y_labels=[f"{np.round(prop*100, 2)}% Cooperators" for prop in prop_list],
         dirname=f"figs/takeover/{dir_graph_name}",
-        name=f'takeover',
-        size=3,
-        darktheme=False,
-        title=f"Development of Takeover",
-        subtitle=f"100 Nodes on {graph_type}"
-    )
-    compareLines(
-        x_list=x_list,
-        y_lists=y_lists,
-        yrange=(-0.02, 1.02),
-        xlabel="Time Step",
-        ylabel="Mean Cooperation Probability",
-        # y_labels=[f"{np.round(prop*100, 2)}% Cooperators" for prop in prop_list],
-        dirname=f"figs/takeover/{dir_graph_name}",
-        name=f'dark_takeover',
+        themes={False: 'takeover', True: 'dark_takeover'},
         size=3,
-        darktheme=True,
         title=f"Development of Takeover",
-        subtitle=f"100 Nodes on {graph_type}"
+        subtitle=f"100 Nodes on {graph_type}",
+        writer=writer
     )
 
 if __name__=='__main__':
+    # Graphs are seeded so they are built once and then loaded from cache/
+    store = ResultsStore('results/main')
+    experiments = []
     n = 100
     for k in [2,3,4,5]:
         deg_seq = [k] * n
         if sum(deg_seq) % 2 != 0:
             deg_seq[0] += 1
-        G = nx.configuration_model(deg_seq)
+        G = cached_graph('configuration_model', deg_seq, seed=0)
         dirname = f"config_{n}_{k}"
         graph_type = f"Config Model, k={k}, n={n}"
-        test_proportions(G, n, dirname, graph_type)
-        test_takeover(G, n, dirname, graph_type)
+        experiments.append((G, n, dirname, graph_type, ('config', n, f'k={k}')))
     n = 1000
     for k in [2,3,4,5]:
         deg_seq = [k] * n
         if sum(deg_seq) % 2 != 0:
             deg_seq[0] += 1
-        G = nx.configuration_model(deg_seq)
+        G = cached_graph('configuration_model', deg_seq, seed=0)
         dirname = f"config_{n}_{k}"
         graph_type = f"Config Model, k={k}, n={n}"
-        test_proportions(G, n, dirname, graph_type)
-        test_takeover(G, n, dirname, graph_type)
+        experiments.append((G, n, dirname, graph_type, ('config', n, f'k={k}')))
 
     n = 100
-    G = nx.gnp_random_graph(n, 0.05)
+    G = cached_graph('gnp_random_graph', n, 0.05, seed=0)
     dirname = "gnp_100_05"
     graph_type = r"Erdős–Rényi Random Graph, $G_{100,0.05}$"
-    test_proportions(G, n, dirname, graph_type)
-    test_takeover(G, n, dirname, graph_type)
+    experiments.append((G, n, dirname, graph_type, ('gnp', n, 'p=0.05')))
 
     n = 1000
-    G = nx.gnp_random_graph(n, 0.05)
+    G = cached_graph('gnp_random_graph', n, 0.05, seed=0)
     dirname = f"gnp_1000_05"
     graph_type = r"Erdős–Rényi Random Graph, $G_{1000,0.05}$"
-    test_proportions(G, n, dirname, graph_type)
-    test_takeover(G, n, dirname, graph_type)
+    experiments.append((G, n, dirname, graph_type, ('gnp', n, 'p=0.05')))
 
     n = 100
     for m in [2,3,4]:
         dirname = f"barabasi_albert_{n}_{m}"
         graph_type = r"Barabasi-Albert Random Graph, $G_{" + f'{n}, {m}' + r"}$"
-        G = nx.barabasi_albert_graph(n, m)
-        test_proportions(G, n, dirname, graph_type)
-        test_takeover(G, n, dirname, graph_type)
+        G = cached_graph('barabasi_albert_graph', n, m, seed=0)
+        experiments.append((G, n, dirname, graph_type, ('barabasi_albert', n, f'm={m}')))
 
     n = 500
     for m in [2,3,4]:
         dirname = f"barabasi_albert_{n}_{m}"
         graph_type = r"Barabasi-Albert Random Graph, $G_{" + f'{n}, {m}' + r"}$"
-        G = nx.barabasi_albert_graph(n, m)
-        test_proportions(G, n, dirname, graph_type)
-        test_takeover(G, n, dirname, graph_type)
+        G = cached_graph('barabasi_albert_graph', n, m, seed=0)
+        experiments.append((G, n, dirname, graph_type, ('barabasi_albert', n, f'm={m}')))
     
     n = 100
-    G = nx.complete_graph(n)
+    G = cached_graph('complete_graph', n)
     dirname = f"complete_{n}"
     graph_type = r"Complete Graph, $K_{" + f'{n}' + r"}$"
-    test_proportions(G, n, dirname, graph_type)
-    test_takeover(G, n, dirname, graph_type)
+    experiments.append((G, n, dirname, graph_type, ('complete', n, '')))
 
     n = 1000
-    G = nx.complete_graph(n)
+    G = cached_graph('complete_graph', n)
     dirname = f"complete_{n}"
     graph_type = r"Complete Graph, $K_{" + f'{n}' + r"}$"
-    test_proportions(G, n, dirname, graph_type)
-    test_takeover(G, n, dirname, graph_type)
-    
-    
+    experiments.append((G, n, dirname, graph_type, ('complete', n, '')))
+
+    # Every graph's proportion replicates share one process pool
+    print(f"Testing Proportions on {len(experiments)} graphs")
+    sweeps = run_proportion_sweep(
+        [G for G, _, _, _, _ in experiments],
+        on_update=sweep_progress,
+        store=store,
+        labels=[label for _, _, _, _, label in experiments])
+    # Figures are written by a background process while the next
+    # experiment simulates
+    with FigureWriter() as writer:
+        for (G, n, dirname, graph_type, label), y_lists in zip(experiments, sweeps):
+            plot_proportions(y_lists, dirname, graph_type, writer)
+            test_takeover(G, n, dirname, graph_type, store=store, label=label, writer=writer)
@@ -0,0 +1,318 @@
+'''
+Description:
+*   Memory-one strategies. An agent's move against a neighbor depends on
+    what the two of them did the last time they met. A strategy is five
+    cooperation probabilities: one for a first meeting (the agent's
+    coop_prob) and one for each last outcome (own move, opponent move).
+*   The last moves are kept per edge in EdgeHistory, as packed bit
+    arrays aligned with the snapshot's edge ids, so a graph's history
+    takes 3 bits per edge and a sweep updates it in one vectorized step.
+*   A memoryless agent is a strategy whose five probabilities are equal,
+    and MemoryOneEngine then plays exactly like RoundEngine given the
+    same random stream.
+'''
+import numpy as np
+from engine import RoundEngine
+from graph import get_agent_table
+from compact import CompactGraph
+import profiling
+
+# (first meeting, after DD, DC, CD, CC), where DC means the agent
+# defected and its opponent cooperated
+STRATEGIES = {
+    'allc': (1, 1, 1, 1, 1),
+    'alld': (0, 0, 0, 0, 0),
+    'tft': (1, 0, 1, 0, 1),
+    'gtft': (1, 1/3, 1, 1/3, 1),
+    'wsls': (1, 1, 0, 0, 1),
+}
+# Pavlov is another name for win-stay, lose-shift
+STRATEGIES['pavlov'] = STRATEGIES['wsls']
+
+
+'''
+Strategy table for some agents
+@param strategies: One entry per agent: a name from STRATEGIES, five
+                   probabilities, or a single coop_prob for a memoryless
+                   agent
+@return: (n, 5) array of (first, DD, DC, CD, CC) probabilities
+'''
+def strategy_table(strategies):
+    rows = []
+    for strategy in strategies:
+        if isinstance(strategy, str):
+            strategy = STRATEGIES[strategy]
+        elif np.ndim(strategy) == 0:
+            strategy = [strategy] * 5
+        rows.append(strategy)
+    return np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+
+# Bit i of a packed array, for an array of i
+def _get_bits(bits, i):
+    return ((bits[i >> 3] >> (7 - (i & 7))) & 1).astype(bool)
+
+
+def _set_bits(bits, i, values):
+    if 8 * len(i) > len(bits):
+        # Many bits: unpacking the whole array is cheaper than ufunc.at
+        unpacked = np.unpackbits(bits)
+        unpacked[i] = values
+        bits[:] = np.packbits(unpacked)
+        return
+    byte = i >> 3
+    mask = (1 << (7 - (i & 7))).astype(np.uint8)
+    np.bitwise_and.at(bits, byte, ~mask)
+    np.bitwise_or.at(bits, byte, mask * np.asarray(values, dtype=np.uint8))
+
+
+# Whether each edge has been played, and the last moves of its src and
+# dst, in numpy.packbits layout
+class EdgeHistory():
+
+    def __init__(self, n_edges):
+        self.n_edges = n_edges
+        n_bytes = (n_edges + 7) // 8
+        self.played = np.zeros(n_bytes, dtype=np.uint8)
+        self.src_move = np.zeros(n_bytes, dtype=np.uint8)
+        self.dst_move = np.zeros(n_bytes, dtype=np.uint8)
+
+    '''
+    @param edges: Edge ids
+    @return: (played, src_move, dst_move) boolean arrays
+    '''
+    def get(self, edges):
+        return (
+            _get_bits(self.played, edges),
+            _get_bits(self.src_move, edges),
+            _get_bits(self.dst_move, edges))
+
+    # Edges must not repeat
+    def set(self, edges, src_move, dst_move):
+        _set_bits(self.played, edges, True)
+        _set_bits(self.src_move, edges, src_move)
+        _set_bits(self.dst_move, edges, dst_move)
+
+    def reset(self):
+        self.played[:] = 0
+        self.src_move[:] = 0
+        self.dst_move[:] = 0
+
+    def copy(self):
+        history = EdgeHistory(self.n_edges)
+        history.played[:] = self.played
+        history.src_move[:] = self.src_move
+        history.dst_move[:] = self.dst_move
+        return history
+
+    def nbytes(self):
+        return self.played.nbytes + self.src_move.nbytes + self.dst_move.nbytes
+
+
+# Slices of a sequence of edge ids, in order, in which no edge repeats
+def _unique_runs(edges):
+    runs = []
+    seen = set()
+    start = 0
+    for k, edge in enumerate(edges.tolist()):
+        if edge in seen:
+            runs.append(slice(start, k))
+            seen.clear()
+            start = k
+        seen.add(edge)
+    runs.append(slice(start, len(edges)))
+    return runs
+
+
+class MemoryOneEngine(RoundEngine):
+
+    '''
+    @param strategies: (N, 5) table from strategy_table. Its first column
+                       becomes the agents' coop_prob.
+    Other arguments are as for RoundEngine.
+    '''
+    def __init__(self, graph, strategies, score, game=None, coop_prob=None):
+        strategies = np.asarray(strategies, dtype=np.float64)
+        if coop_prob is None:
+            coop_prob = strategies[:, 0].copy()
+        else:
+            coop_prob[:] = strategies[:, 0]
+        # Cooperation after each last outcome, indexed 2 * own + opponent
+        self.responses = strategies[:, 1:].copy()
+        self.history = EdgeHistory(len(graph.src))
+        super().__init__(graph, coop_prob, score, game=game)
+
+    '''
+    Build an engine on a graph whose nodes already carry agents, as
+    RoundEngine.from_graph. The table's coop_prob column is set to the
+    strategies' first moves and kept up to date.
+    '''
+    @classmethod
+    def from_graph(cls, G, strategies, agent_tag='agent', game=None):
+        if not isinstance(G, CompactGraph):
+            G = CompactGraph.from_networkx(G)
+        table = get_agent_table(G, agent_tag)
+        if table.ids != G.node_ids:
+            raise ValueError("Agent table does not match the graph's nodes, call add_agents again")
+        return cls(G, strategy_table(strategies), table.score, game, coop_prob=table.coop_prob)
+
+    def strategies(self):
+        return np.column_stack([self.coop_prob, self.responses])
+
+    # A memory-one population can cycle forever, so it never counts as
+    # absorbing
+    def is_absorbing(self):
+        return False
+
+    '''
+    Play every live edge once, as RoundEngine.play_round. Moves come
+    from each edge's history, and the history is updated in one step.
+    Partial rounds (nodes) are not supported.
+    '''
+    def play_round(self, takeover=True, rng=None):
+        if rng is None:
+            rng = np.random
+        prof = profiling.active
+        if prof is not None:
+            start = prof.start()
+        edges = self.graph.live_edge_ids()
+        src = self.graph.src[edges]
+        dst = self.graph.dst[edges]
+        draws = rng.random(2 * len(edges)).reshape(-1, 2)
+        self_choice, opp_choice = self._play_games(src, dst, edges, draws, takeover)
+        self.add_payoffs(src, dst, self_choice, opp_choice)
+        if prof is not None:
+            prof.played(start, len(src), 2 * len(src),
+                        self.count_takeovers(self_choice, opp_choice) if takeover else 0)
+        return self_choice, opp_choice
+
+    '''
+    Play a given sequence of games in order, as RoundEngine.play_edges,
+    each with the history of its edge. A game sees the moves of earlier
+    games on the same edge in the sequence.
+    @param edges: Edge id of each game, as sampled by the schedules.
+                  Without them each game is played on the first live
+                  edge joining its two players.
+    '''
+    def play_edges(self, src, dst, takeover=True, rng=None, edges=None):
+        if rng is None:
+            rng = np.random
+        prof = profiling.active
+        if prof is not None:
+            start = prof.start()
+        if edges is None:
+            edges = self._edge_ids(src, dst)
+        draws = rng.random(2 * len(src)).reshape(-1, 2)
+        self_choice = np.empty(len(src), dtype=bool)
+        opp_choice = np.empty(len(src), dtype=bool)
+        for games in _unique_runs(edges):
+            self_choice[games], opp_choice[games] = self._play_games(
+                src[games], dst[games], edges[games], draws[games], takeover)
+        self.add_payoffs(src, dst, self_choice, opp_choice)
+        if prof is not None:
+            prof.played(start, len(src), 2 * len(src),
+                        self.count_takeovers(self_choice, opp_choice) if takeover else 0)
+        return self_choice, opp_choice
+
+    # Games on distinct edges: moves come from the history, which is then
+    # updated in one step. A game whose src is its edge's dst (as picked
+    # by NodeSchedule) reads and writes the history the other way round.
+    def _play_games(self, src, dst, edges, draws, takeover):
+        played, src_last, dst_last = self.history.get(edges)
+        flip = self.graph.src[edges] != src
+        self_last = np.where(flip, dst_last, src_last)
+        opp_last = np.where(flip, src_last, dst_last)
+        if takeover:
+            self_choice, opp_choice = self._play_sequential_memory(
+                src, dst, draws[:, 1], draws[:, 0], played, self_last, opp_last)
+        else:
+            src_state = 2 * self_last + opp_last
+            dst_state = 2 * opp_last + self_last
+            self_prob = np.where(played, self.responses[src, src_state], self.coop_prob[src])
+            opp_prob = np.where(played, self.responses[dst, dst_state], self.coop_prob[dst])
+            self_choice = draws[:, 1] < self_prob
+            opp_choice = draws[:, 0] < opp_prob
+        self.history.set(
+            edges, np.where(flip, opp_choice, self_choice), np.where(flip, self_choice, opp_choice))
+        return self_choice, opp_choice
+
+    # Id of the first live edge between each (src, dst) pair, either way
+    def _edge_ids(self, src, dst):
+        graph = self.graph
+        ids = graph.live_edge_ids()
+        n = len(graph)
+        keys = np.minimum(graph.src[ids], graph.dst[ids]) * n + np.maximum(graph.src[ids], graph.dst[ids])
+        order = np.argsort(keys, kind='stable')
+        wanted = np.minimum(src, dst) * n + np.maximum(src, dst)
+        found = np.searchsorted(keys[order], wanted)
+        if np.any(found == len(ids)) or np.any(keys[order][np.minimum(found, len(ids) - 1)] != wanted):
+            raise ValueError("Some games are not played on a live edge")
+        return ids[order[found]]
+
+    # As RoundEngine._play_sequential. The loser's whole strategy moves
+    # toward the winner's, entry by entry.
+    def _play_sequential_memory(self, src, dst, self_draws, opp_draws, played, src_last, dst_last):
+        loser = self.game.loser.tolist()
+        update = self.game.update_function()
+        probs = self.coop_prob.tolist()
+        responses = self.responses.tolist()
+        src_state = (2 * src_last + dst_last).tolist()
+        dst_state = (2 * dst_last + src_last).tolist()
+        played = played.tolist()
+        src = src.tolist()
+        dst = dst.tolist()
+        self_draws = self_draws.tolist()
+        opp_draws = opp_draws.tolist()
+        n_edges = len(src)
+        self_choice = np.empty(n_edges, dtype=bool)
+        opp_choice = np.empty(n_edges, dtype=bool)
+        changed = []
+        for k in range(n_edges):
+            u = src[k]
+            v = dst[k]
+            if played[k]:
+                opp = opp_draws[k] < responses[v][dst_state[k]]
+                me = self_draws[k] < responses[u][src_state[k]]
+            else:
+                opp = opp_draws[k] < probs[v]
+                me = self_draws[k] < probs[u]
+            lost = loser[me][opp]
+            if lost:
+                a, b = (u, v) if lost == 1 else (v, u)
+                probs[a] = update(probs[a], probs[b])
+                responses[a] = [update(r, s) for r, s in zip(responses[a], responses[b])]
+                changed.append(a)
+            self_choice[k] = me
+            opp_choice[k] = opp
+        if changed:
+            changed = np.unique(changed)
+            old = self.coop_prob[changed]
+            new = np.array([probs[i] for i in changed])
+            self.n_zero += int(np.count_nonzero(new == 0)) - int(np.count_nonzero(old == 0))
+            self.n_one += int(np.count_nonzero(new == 1)) - int(np.count_nonzero(old == 1))
+            if self.recorder is not None:
+                self.recorder.on_change(changed, old, new)
+        self.coop_prob[:] = probs
+        self.responses[:] = responses
+        return self_choice, opp_choice
+
+    # Also keeps the responses and edge history of the agents left
+    def compact(self):
+        nodes, edges = super().compact()
+        self.responses = self.responses[nodes]
+        history = EdgeHistory(len(edges))
+        bits = self.history.get(edges)
+        history.played[:], history.src_move[:], history.dst_move[:] = map(np.packbits, bits)
+        self.history = history
+        return nodes, edges
+
+    def checkpoint(self, rng=None):
+        state = super().checkpoint(rng)
+        state['responses'] = self.responses.copy()
+        state['history'] = self.history.copy()
+        return state
+
+    def restore(self, state, rng=None):
+        self.responses[:] = state['responses']
+        self.history = state['history'].copy()
+        return super().restore(state, rng)
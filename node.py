@@ -19,7 +19,7 @@ class Node():
         self.sucker = 3
         self.punishment = 2
         self.reward = 1
-        self.tempation = 0
+        self.temptation = 0
 
     def __repr__(self):
         return f"{self.id}: ({self.score}, {self.coop_prob})"
@@ -33,14 +33,18 @@ class Node():
     
     # 1 = cooperate
     # 0 = defect
-    def strategy(self):
-        return bool(rand() < self.coop_prob)
+    # draw is a uniform [0, 1) sample, taken from numpy.random if not given
+    def strategy(self, draw=None):
+        if draw is None:
+            draw = rand()
+        return bool(draw < self.coop_prob)
 
     # u is an instance of another node
     # Compare their strategies and update score accordingly
-    def update_score(self, u, takeover=True):
-        opponent_choice = u.strategy()
-        self_choice = self.strategy()
+    # draws: optional pre-drawn (opponent, self) uniforms for the two choices
+    def update_score(self, u, takeover=True, draws=(None, None)):
+        opponent_choice = u.strategy(draws[0])
+        self_choice = self.strategy(draws[1])
         # Both cooperate
         if (self_choice and opponent_choice):
             self.score += self.reward
@@ -73,10 +77,9 @@ class Node():
 
         return self_choice
         
-    def taken_over_by(self, new_strategy):
+    def taken_over_by(self, new_strategy, increment=0.1):
         # Gets called on a node that is getting taken over
         # gets strategy passed as an argument
-        increment =0.1
         current_strategy = self.coop_prob
 
         if current_strategy > new_strategy:
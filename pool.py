@@ -0,0 +1,33 @@
+'''
+Description:
+*   Process pool runner shared by the proportion sweep and the frame
+    renderer. Each caller keeps its per-worker state in its own module
+    and passes the initializer that sets it, so every worker process
+    gets that state once rather than with every task.
+*   workers=1 runs the initializer and the tasks inline, in this
+    process, which is easier to debug and profile.
+'''
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+'''
+Run a function over tasks, from a pool or inline when workers == 1
+@param run: Module-level function of one task, so that it pickles
+@param tasks: Iterable of tasks
+@param initializer: Called once per worker with initargs
+@param workers: Worker processes. None uses every core.
+@param ordered: Yield results in task order, or as they finish
+@return: Yields run(task) for every task
+'''
+def run_tasks(run, tasks, initializer, initargs=(), workers=None, ordered=True):
+    if workers == 1:
+        initializer(*initargs)
+        yield from map(run, tasks)
+        return
+    with ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as pool:
+        if ordered:
+            yield from pool.map(run, tasks)
+            return
+        futures = [pool.submit(run, task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,199 @@
+'''
+Description:
+*   Opt-in instrumentation of the simulation loop. While a Profiler is
+    active, the hot paths add their time to named phases with
+    perf_counter_ns and bump counters for RNG draws, games and takeovers:
+        setup      add_agents, add_rand_agents
+        kill       kill scans, in update_scores and the engines
+        play       edge play, in update_scores and the engines
+        sync       update_score_attribute
+        metrics    Recorder.record
+        plot       draw_graph, save_animation and figure saving
+*   Disabled, every hook is one check of profiling.active against None,
+    so leaving the hooks in costs nothing measurable.
+*   SamplingProfiler optionally samples the main thread's stack from a
+    background thread, to see where the time goes inside a phase. Pool
+    workers are separate processes, so profile sweeps with workers=1.
+*   Reports are plain dicts, and save() writes them as JSON:
+        with profile(sample=True) as prof:
+            run_proportion_sweep([G], workers=1)
+        prof.save('results/profile.json')
+'''
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from os import makedirs
+from os.path import dirname
+
+# The Profiler the hooks report to, None when profiling is off
+active = None
+
+
+class Profiler():
+
+    def __init__(self):
+        self.phase_ns = Counter()
+        self.phase_calls = Counter()
+        self.counters = Counter()
+        self.sampler = None
+        self.started = time.perf_counter_ns()
+
+    # Start of a phase, to pass to stop
+    def start(self):
+        return time.perf_counter_ns()
+
+    def stop(self, phase, start):
+        self.phase_ns[phase] += time.perf_counter_ns() - start
+        self.phase_calls[phase] += 1
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.stop(name, start)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    # End of a 'play' phase, with what it drew and played
+    def played(self, start, games, draws, takeovers=0):
+        self.stop('play', start)
+        self.counters['games'] += games
+        self.counters['rng_draws'] += draws
+        self.counters['takeovers'] += takeovers
+
+    '''
+    @return: Dict with the 'wall_seconds' since the profiler was made,
+             'phases' (seconds, calls and mean microseconds per call),
+             'counters', and the sampler's report if there is one
+    '''
+    def report(self):
+        report = {
+            'wall_seconds': (time.perf_counter_ns() - self.started) / 1e9,
+            'phases': {
+                name: {
+                    'seconds': ns / 1e9,
+                    'calls': self.phase_calls[name],
+                    'mean_us': ns / 1e3 / self.phase_calls[name],
+                }
+                for name, ns in sorted(self.phase_ns.items())},
+            'counters': dict(sorted(self.counters.items())),
+        }
+        if self.sampler is not None:
+            report['samples'] = self.sampler.report()
+        return report
+
+    def save(self, path):
+        if dirname(path):
+            makedirs(dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+'''
+Statistical profiler for the thread that started it. A daemon thread
+wakes every interval and records which functions are on the stack.
+@param interval: Seconds between samples
+'''
+class SamplingProfiler():
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.own = Counter()
+        self.total = Counter()
+        self.n_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            self.n_samples += 1
+            self.own[_function(frame)] += 1
+            seen = set()
+            while frame is not None:
+                seen.add(_function(frame))
+                frame = frame.f_back
+            self.total.update(seen)
+
+    '''
+    @param top: Functions listed, by samples inside them
+    @return: Dict with the number of 'samples' and the 'functions' that
+             took most: the fraction of samples with the function on top
+             of the stack ('own') or anywhere on it ('total')
+    '''
+    def report(self, top=25):
+        n = max(self.n_samples, 1)
+        return {
+            'interval': self.interval,
+            'samples': self.n_samples,
+            'functions': [
+                {'function': name, 'own': self.own[name] / n, 'total': self.total[name] / n}
+                for name, _ in self.total.most_common(top)],
+        }
+
+
+def _function(frame):
+    code = frame.f_code
+    return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+
+def enable(profiler=None):
+    global active
+    active = Profiler() if profiler is None else profiler
+    return active
+
+
+def disable():
+    global active
+    profiler, active = active, None
+    return profiler
+
+
+'''
+Profile a block of code
+@param sample: Also run a SamplingProfiler over the block
+@param interval: Seconds between samples
+@return: Yields the active Profiler, whose report covers the block
+'''
+@contextmanager
+def profile(sample=False, interval=0.005):
+    profiler = enable()
+    if sample:
+        profiler.sampler = SamplingProfiler(interval).start()
+    try:
+        yield profiler
+    finally:
+        if profiler.sampler is not None:
+            profiler.sampler.stop()
+        disable()
+
+
+if __name__ == '__main__':
+    # A profiled test_proportions sweep on a small G(n,p) graph. The
+    # hooks report to the imported module, not to this script's copy.
+    import profiling
+    from graph_cache import cached_graph
+    from sweep import run_proportion_sweep
+    G = cached_graph('gnp_random_graph', 100, 0.05, seed=0)
+    with profiling.profile(sample=True) as prof:
+        run_proportion_sweep([G], seed=0, workers=1)
+    print(json.dumps(prof.report(), indent=2))
@@ -0,0 +1,176 @@
+'''
+Description:
+*   Streaming time-series recorder for a RoundEngine. Running totals
+    (sum of coop_probs, cooperator/defector counts, score sums per class
+    and a coop_prob histogram) are kept up to date from the engine's
+    hooks: takeovers report only the agents that changed, and payoffs
+    arrive as the per-game arrays the engine already computed.
+*   record() copies the current aggregates into a preallocated ring
+    buffer, so observing a step costs O(1) instead of a pass over every
+    agent.
+'''
+import numpy as np
+import profiling
+
+COLUMNS = [
+    'step',
+    'mean_coop_prob',
+    'n_coop',
+    'n_defect',
+    'coop_mean_score',
+    'defect_mean_score',
+]
+
+
+class Recorder():
+
+    '''
+    @param capacity: Rows kept in the ring buffer. Older rows are
+                     overwritten once it is full.
+    @param n_bins: Histogram bins over coop_prob in [0, 1]
+    @param threshold: Agents with coop_prob >= threshold count as
+                      cooperators, as in test_proportions
+    '''
+    def __init__(self, capacity=1024, n_bins=10, threshold=0.5):
+        self.capacity = capacity
+        self.n_bins = n_bins
+        self.threshold = threshold
+        self.columns = COLUMNS + [f'hist_{i}' for i in range(n_bins)]
+        self.buffer = np.zeros((capacity, len(self.columns)))
+        self.count = 0
+        self.engine = None
+
+    def bins(self, coop_prob):
+        return np.minimum((np.asarray(coop_prob) * self.n_bins).astype(np.intp), self.n_bins - 1)
+
+    # Full O(N) pass, done once when attached (or after a restore)
+    def attach(self, engine):
+        self.engine = engine
+        live = engine.graph.live
+        coop_prob = engine.coop_prob
+        self.is_coop = (coop_prob >= self.threshold) & live
+        self.n_live = int(np.count_nonzero(live))
+        self.coop_prob_sum = float(coop_prob[live].sum())
+        self.n_coop = int(np.count_nonzero(self.is_coop))
+        self.coop_score_sum = float(engine.score[self.is_coop].sum())
+        self.all_score_sum = float(engine.score[live].sum())
+        self.hist = np.bincount(self.bins(coop_prob[live]), minlength=self.n_bins)
+        engine.recorder = self
+        return self
+
+    '''
+    Called by the engine after takeovers, once per changed agent
+    @param changed: Positions whose coop_prob changed
+    @param old, new: Their coop_probs before and after
+    '''
+    def on_change(self, changed, old, new):
+        self.coop_prob_sum += float(new.sum() - old.sum())
+        np.subtract.at(self.hist, self.bins(old), 1)
+        np.add.at(self.hist, self.bins(new), 1)
+        was_coop = self.is_coop[changed]
+        now_coop = new >= self.threshold
+        moved = was_coop != now_coop
+        if moved.any():
+            # A switching agent takes its score to its new class
+            scores = self.engine.score[changed[moved]]
+            signs = np.where(now_coop[moved], 1, -1)
+            self.coop_score_sum += float((signs * scores).sum())
+            self.n_coop += int(signs.sum())
+            self.is_coop[changed[moved]] = now_coop[moved]
+
+    # Called by the engine with the payoff of every game it just scored
+    def on_payoffs(self, src, dst, self_pay, opp_pay):
+        self.all_score_sum += float(self_pay.sum() + opp_pay.sum())
+        self.coop_score_sum += float(
+            self_pay[self.is_coop[src]].sum() + opp_pay[self.is_coop[dst]].sum())
+
+    # Called by the engine when agents are removed
+    def on_kill(self, dead):
+        live_coop = self.is_coop[dead]
+        scores = self.engine.score[dead]
+        self.n_live -= len(dead)
+        self.coop_prob_sum -= float(self.engine.coop_prob[dead].sum())
+        self.all_score_sum -= float(scores.sum())
+        self.coop_score_sum -= float(scores[live_coop].sum())
+        self.n_coop -= int(np.count_nonzero(live_coop))
+        self.is_coop[dead] = False
+        np.subtract.at(self.hist, self.bins(self.engine.coop_prob[dead]), 1)
+
+    # Called by the engine when agents are born into dead positions
+    def on_birth(self, born):
+        coop_prob = self.engine.coop_prob[born]
+        scores = self.engine.score[born]
+        now_coop = coop_prob >= self.threshold
+        self.n_live += len(born)
+        self.coop_prob_sum += float(coop_prob.sum())
+        self.all_score_sum += float(scores.sum())
+        self.coop_score_sum += float(scores[now_coop].sum())
+        self.n_coop += int(np.count_nonzero(now_coop))
+        self.is_coop[born] = now_coop
+        np.add.at(self.hist, self.bins(coop_prob), 1)
+
+    # Called by the engine when scores grow without any game being
+    # reported, e.g. when fast-forwarding an absorbing state
+    def on_gain(self, gain):
+        self.all_score_sum += float(gain[self.engine.graph.live].sum())
+        self.coop_score_sum += float(gain[self.is_coop].sum())
+
+    '''
+    Record steps that are not going to be played, once the engine is
+    absorbing. Nothing but the scores can change, and they grow by the
+    same gain every step.
+    @param steps: Labels of the rows to add, one step apart
+    @param gain: Score gained by each position per step
+    '''
+    def record_absorbed(self, steps, gain):
+        all_gain = float(gain[self.engine.graph.live].sum())
+        coop_gain = float(gain[self.is_coop].sum())
+        all_sum, coop_sum = self.all_score_sum, self.coop_score_sum
+        for i, step in enumerate(steps, 1):
+            self.all_score_sum = all_sum + i * all_gain
+            self.coop_score_sum = coop_sum + i * coop_gain
+            self.record(step)
+        self.all_score_sum, self.coop_score_sum = all_sum, coop_sum
+
+    def n_defect(self):
+        return self.n_live - self.n_coop
+
+    def mean_coop_prob(self):
+        return self.coop_prob_sum / self.n_live if self.n_live else 0
+
+    def coop_mean_score(self):
+        return self.coop_score_sum / self.n_coop if self.n_coop else 0
+
+    def defect_mean_score(self):
+        defect_score_sum = self.all_score_sum - self.coop_score_sum
+        return defect_score_sum / self.n_defect() if self.n_defect() else 0
+
+    # Appends the current aggregates as one row of the ring buffer
+    def record(self, step=None):
+        prof = profiling.active
+        if prof is not None:
+            start = prof.start()
+        row = self.buffer[self.count % self.capacity]
+        row[0] = self.count if step is None else step
+        row[1] = self.mean_coop_prob()
+        row[2] = self.n_coop
+        row[3] = self.n_defect()
+        row[4] = self.coop_mean_score()
+        row[5] = self.defect_mean_score()
+        row[len(COLUMNS):] = self.hist
+        self.count += 1
+        if prof is not None:
+            prof.stop('metrics', start)
+
+    # Recorded rows, oldest first
+    def series(self):
+        if self.count <= self.capacity:
+            return self.buffer[:self.count]
+        start = self.count % self.capacity
+        return np.concatenate([self.buffer[start:], self.buffer[:start]])
+
+    def column(self, name):
+        return self.series()[:, self.columns.index(name)]
+
+    def __len__(self):
+        return min(self.count, self.capacity)
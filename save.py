@@ -3,18 +3,19 @@
 # * [Plotly Tutorial](https://plotly.com/python/network-graphs/)
 
 from os import makedirs, listdir, getcwd
-from networkx import write_gexf, set_node_attributes, shell_layout
-from graph import set_node_positions
-import plotly.graph_objects as go
-import imageio
-import matplotlib as mpl
+from graph import set_node_positions, get_agent_table
+from compact import CompactGraph
 import numpy as np
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import profiling
 import os
+# networkx, plotly, imageio and matplotlib are imported on first use,
+# so importing this module costs nothing to processes that only simulate
 
 
 # Save the graph in gexf format
 def save_gexf(G, filename, dirname):
+    from networkx import write_gexf
     makedirs(f'graphs/{dirname}', exist_ok=True)
     write_gexf(G, f"graphs/{dirname}/{filename}.gexf")
 
@@ -26,34 +27,140 @@ def save_gexf(G, filename, dirname):
 #                 Given in the form 'dir1/dir2' or 'dirname'
 #                 (No trailing forward-slash) (Optional)
 # @param pos: The networkx positional layout for the graph (Optional)
-def draw_graph(G, filename, dirname=None, title=None):
+# @param snapshot: A CompactGraph of G. Only its live nodes and edges
+#                  are drawn, so killed agents drop out. (Optional)
+# @param renderer: A GraphRenderer of G to reuse between calls, so the
+#                  edge geometry is only built once (Optional)
+def draw_graph(G, filename, dirname=None, title=None, snapshot=None, renderer=None):
     kill_score_cap=200
-    # Add edges to plot
-    edge_x = []
-    edge_y = []
-    for edge in G.edges():
-        x0, y0 = G.nodes[edge[0]]['pos']
-        x1, y1 = G.nodes[edge[1]]['pos']
-        edge_x.append(x0)
-        edge_x.append(x1)
-        edge_x.append(None)
-        edge_y.append(y0)
-        edge_y.append(y1)
-        edge_y.append(None)
+    prof = profiling.active
+    if prof is not None:
+        start = prof.start()
+    if snapshot is None:
+        snapshot = CompactGraph.from_networkx(G)
+    if renderer is None:
+        renderer = GraphRenderer.from_graph(G, snapshot)
+    # Color Node Points, in snapshot order: after kills the table can
+    # hold rows for nodes the snapshot no longer has
+    table = get_agent_table(G)
+    fig = renderer.figure(snapshot.live, table.score[table.positions(snapshot.node_ids)])
+    dir_path = f'graphs/{dirname}/'
+    makedirs(dir_path, exist_ok=True)
+    fig.write_image(f'{dir_path}{filename}.png', format='png', width=1024, height=768)
+    if prof is not None:
+        prof.stop('plot', start)
+
+# Edge segments as vertex arrays for a plotly line trace, with a NaN
+# between segments where draw_graph puts None
+# @param pos: (N, 2) array of node positions
+# @param src, dst: Edge endpoint positions
+def edge_vertices(pos, src, dst):
+    edge_x = np.full(3 * len(src), np.nan)
+    edge_y = np.full(3 * len(src), np.nan)
+    edge_x[0::3], edge_y[0::3] = pos[src].T
+    edge_x[1::3], edge_y[1::3] = pos[dst].T
+    return edge_x, edge_y
+
+# Draws frames of one graph with a fixed layout.
+# The edge vertex buffers and the figure are built once. A frame only
+# swaps the node color and opacity arrays, and blanks the edges of
+# nodes killed since the last frame, so its cost depends on the number
+# of nodes rather than edges.
+class GraphRenderer():
+
+    # @param pos: (N, 2) array of node positions
+    # @param snapshot: CompactGraph giving the edges and CSR adjacency
+    def __init__(self, pos, snapshot):
+        self.pos = np.asarray(pos, dtype=np.float64)
+        self.indptr = snapshot.indptr
+        self.edge_of = snapshot.edge_of
+        self.src = snapshot.src
+        self.dst = snapshot.dst
+        self.edge_x, self.edge_y = edge_vertices(self.pos, self.src, self.dst)
+        # Nodes whose edges are currently in the buffers
+        self.live = np.ones(len(self.pos), dtype=bool)
+        self.fig = None
+
+    # @param G: The networkx graph holding the 'pos' attributes
+    #           set by set_node_positions
+    @classmethod
+    def from_graph(cls, G, snapshot):
+        pos = [G.nodes[u]['pos'] for u in snapshot.node_ids]
+        return cls(pos, snapshot)
+
+    # Edge ids of every edge touching some nodes, via the CSR rows
+    def _incident(self, nodes):
+        starts = self.indptr[nodes]
+        lengths = self.indptr[nodes + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return np.unique(self.edge_of[offsets + np.arange(lengths.sum(), dtype=np.intp)])
+
+    # Brings the edge buffers up to date with a live mask
+    # @return: Whether any edge changed
+    def _update_edges(self, live):
+        changed = np.flatnonzero(self.live != live)
+        if len(changed) == 0:
+            return False
+        self.live = live.copy()
+        edges = self._incident(changed)
+        shown = live[self.src[edges]] & live[self.dst[edges]]
+        hidden = edges[~shown]
+        self.edge_x[3 * hidden] = self.edge_x[3 * hidden + 1] = np.nan
+        self.edge_y[3 * hidden] = self.edge_y[3 * hidden + 1] = np.nan
+        # Revived nodes, e.g. after a restore, get their edges back
+        shown = edges[shown]
+        self.edge_x[3 * shown], self.edge_y[3 * shown] = self.pos[self.src[shown]].T
+        self.edge_x[3 * shown + 1], self.edge_y[3 * shown + 1] = self.pos[self.dst[shown]].T
+        return True
+
+    # The figure for one frame
+    # @param live: Mask of the nodes to draw
+    # @param scores: Score of every node, used as its color
+    def figure(self, live, scores):
+        live = np.asarray(live, dtype=bool)
+        scores = np.asarray(scores, dtype=np.float64)
+        if self.fig is None:
+            self._update_edges(live)
+            node_x, node_y = self.pos.T
+            self.fig = graph_figure(self.edge_x, self.edge_y, node_x, node_y, scores.tolist())
+        elif self._update_edges(live):
+            self.fig.data[0].x = self.edge_x
+            self.fig.data[0].y = self.edge_y
+        marker = self.fig.data[1].marker
+        marker.color = scores
+        marker.opacity = live.astype(np.float64)
+        # The color scale spans the drawn nodes only, as if the dead
+        # ones were not in the trace
+        if live.any():
+            marker.cmin = scores[live].min()
+            marker.cmax = scores[live].max()
+        self.fig.data[1].text = [f'Score: {score}' for score in scores.tolist()]
+        return self.fig
+
+    # One frame as an image array
+    def image(self, live, scores, width=1024, height=768):
+        import imageio.v2 as imageio
+        png = self.figure(live, scores).to_image(format='png', width=width, height=height)
+        return imageio.imread(png)
+
+    # The figure is rebuilt where unpickled, e.g. in pool workers
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['fig'] = None
+        return state
+
+# The plotly figure drawn by draw_graph
+# @param edge_x, edge_y: Edge vertices, segments separated by None/NaN
+# @param node_x, node_y: Node positions
+# @param node_scores: Node colors, in the same order
+def graph_figure(edge_x, edge_y, node_x, node_y, node_scores):
+    import plotly.graph_objects as go
     edge_trace = go.Scatter(
         x=edge_x, y=edge_y,
         line=dict(width=0.5, color='White'),
         # line=dict(width=0.5, color='#888'),
         hoverinfo='none',
         mode='lines')
-    # Add nodes to plot
-    node_x = []
-    node_y = []
-    for node in G.nodes():
-        x, y = G.nodes[node]['pos']
-        node_x.append(x)
-        node_y.append(y)
-
     node_trace = go.Scatter(
         x=node_x, y=node_y,
         mode='markers',
@@ -89,15 +196,8 @@ def draw_graph(G, filename, dirname=None, title=None):
                 x=1
             ),
             line_width=2))
-    # Color Node Points
-    node_scores = []
-    node_text = []
-    for node in G.nodes():
-        node_scores.append(G.nodes[node]['score'])
-        node_text.append(f'Score: {G.nodes[node]["score"]}')
-
     node_trace.marker.color = node_scores
-    node_trace.text = node_text
+    node_trace.text = [f'Score: {score}' for score in node_scores]
     fig = go.Figure(data=[edge_trace, node_trace],
              layout=go.Layout(
                 titlefont_size=16,
@@ -127,9 +227,7 @@ def draw_graph(G, filename, dirname=None, title=None):
             'x': 0.5,
             'xanchor': 'center',
             'yanchor': 'top' })
-    dir_path = f'graphs/{dirname}/'
-    makedirs(dir_path, exist_ok=True)
-    fig.write_image(f'{dir_path}{filename}.png', format='png', width=1024, height=768)
+    return fig
 
 
 def sort_by_prefix(filenames, prefix_list):
@@ -141,6 +239,7 @@ def sort_by_prefix(filenames, prefix_list):
     return filenames_out
     
 def save_gif(filename_skeleton, dirname='test1'):
+    import imageio
     print(f'Save Gif')
     makedirs(f'graphs/{dirname}', exist_ok=True)
     # pathname = f'{getcwd()}/graphs/{dirname}/'
@@ -174,6 +273,216 @@ def get_color(i, darktheme=False):
     return color_options[i % len(color_options)]
     
     
+# Foreground, secondary foreground and background colors of each theme.
+# compareScatter's themes are the other way round from compareLines'.
+LINE_THEMES = {
+    False: ('black', '#1a1a1a', 'white'),
+    True: ('white', '#D9D9D9', 'black'),
+}
+SCATTER_THEMES = {
+    False: ('white', 'grey', 'black'),
+    True: ('black', 'grey', 'white'),
+}
+FORMATS = ('png', 'svg')
+
+
+# A comparison figure drawn once and saved in several themes and formats.
+# Drawing is done without pyplot, so the figure can be pickled and saved
+# in another process, or in a background thread.
+class ThemedPlot():
+
+    # @param style: 'lines' (compareLines), 'scatter' (compareScatter)
+    #               or 'many' (manyLines)
+    def __init__(
+        self,
+        style,
+        x_list,
+        y_lists,
+        y_labels=None,
+        title=None,
+        subtitle=None,
+        xlabel=None,
+        ylabel=None,
+        logx=False,
+        logy=False,
+        xrange=None, #Tuple
+        yrange=None, #Tuple
+        legend_pos=0,
+        size=10,
+    ):
+        from matplotlib.figure import Figure
+        x_len = len(x_list)
+        for y_list in y_lists:
+            if len(y_list) != x_len:
+                print(
+                    f"Array size mismatch in {title}"
+                    + f"\ny len {len(y_list)} != {x_len}"
+                )
+        self.style = style
+        self.themes = SCATTER_THEMES if style == 'scatter' else LINE_THEMES
+        self.legend_pos = legend_pos
+        alpha = 0.8
+        if len(y_lists) > 1:
+            alpha = 0.3
+        self.fig = Figure(figsize=(10, 5), dpi=300)
+        ax = self.ax = self.fig.subplots(1, 1)
+        # Set up Axis Definition
+        min_x = min(x_list)
+        max_x = max(x_list)
+        min_y = min([min(y_list) for y_list in y_lists])
+        max_y = max([max(y_list) for y_list in y_lists]) 
+        max_y = max_y + (max_y - min_y)*0.05 # 5% vertical buffer
+        if (xrange):
+            min_x = xrange[0]
+            max_x = xrange[1]
+        if (yrange):
+            min_y = yrange[0]
+            max_y = yrange[1]
+        ax.axis([
+            min_x,
+            max_x,
+            min_y,
+            max_y])
+        # (artist, series index) pairs, recolored with the theme
+        self.series = []
+        self.legend = y_labels is not None
+        labels = y_labels if self.legend else [None] * len(y_lists)
+        for i, label in enumerate(labels):
+            if style == 'many':
+                if self.legend:
+                    ax.fill_between(
+                        x_list, y_lists[i], color="black", alpha=alpha,
+                        linewidth=1, label=label)
+                else:
+                    ax.plot(x_list, y_lists[i], color="black", alpha=alpha, linewidth=1)
+                continue
+            if style == 'scatter':
+                line = ax.fill_between(
+                    x_list, y_lists[i], alpha=alpha, linewidth=0.5, label=label)
+            else:
+                [line] = ax.plot(
+                    x_list, y_lists[i], alpha=alpha, linewidth=2, label=label)
+            points = ax.scatter(
+                x_list, y_lists[i], alpha=alpha + ((1-alpha)/2), s=size)
+            self.series += [(line, i), (points, i)]
+        self.title = self.suptitle = None
+        if title:
+            if subtitle:
+                mid = (self.fig.subplotpars.right + self.fig.subplotpars.left)/2
+                self.title = ax.set_title(f"{subtitle}", size=12 if style == 'scatter' else 14)
+                self.suptitle = self.fig.suptitle(f"{title}", size=18, x=mid)
+            else:
+                self.suptitle = ax.set_title(f"{title}", size=18)
+        self.labels = []
+        if xlabel:
+            if logx:
+                ax.set_xscale('log')
+                xlabel = f'Log {xlabel}'
+            self.labels.append(ax.set_xlabel(xlabel))
+        if ylabel:
+            if logy:
+                ax.set_yscale('log')
+                ylabel = f'Log {ylabel}'
+            self.labels.append(ax.set_ylabel(ylabel))
+        self.set_theme(False)
+
+    # Recolors every artist, without drawing anything again
+    def set_theme(self, darktheme):
+        fg_color, fg_color2, bg_color = self.themes[darktheme]
+        ax = self.ax
+        ax.patch.set_facecolor(bg_color)
+        ax.tick_params(color=fg_color, labelcolor=fg_color)
+        for spine in ax.spines.values():
+            spine.set_edgecolor(fg_color)
+        self.fig.patch.set_facecolor(bg_color)
+        for artist, i in self.series:
+            artist.set_color(get_color(i, darktheme))
+        if self.style == 'many':
+            ax.grid(visible=True, alpha=0.2, color=fg_color2, linewidth=0.5)
+            if self.legend:
+                ax.legend(loc=self.legend_pos)
+        else:
+            ax.grid(visible=True, alpha=0.7, color=fg_color, linewidth=0.5)
+            if self.legend:
+                ax.legend(loc=self.legend_pos, facecolor=bg_color, framealpha=0.5)
+        if self.title:
+            self.title.set_color(fg_color2)
+        if self.suptitle:
+            self.suptitle.set_color(fg_color)
+        for label in self.labels:
+            label.set_color(fg_color)
+
+    # PNGs go in dirname, other formats in dirname-<format>
+    def save(self, name, dirname="figs", formats=FORMATS):
+        for fmt in formats:
+            fmt_dirname = dirname if fmt == 'png' else f"{dirname}-{fmt}"
+            makedirs(fmt_dirname, exist_ok=True)
+            self.fig.savefig(f"{fmt_dirname}/{name}.{fmt}", format=fmt)
+
+    # @param themes: Dict of darktheme to file name, e.g.
+    #                {False: 'proportions', True: 'dark_proportions'}
+    def save_themes(self, themes, dirname="figs", formats=FORMATS):
+        for darktheme, name in themes.items():
+            self.set_theme(darktheme)
+            self.save(name, dirname, formats)
+
+
+# Saves ThemedPlots in the background, so the next experiment can
+# simulate while the last one's figures are written.
+# With processes=True the plots are pickled to worker processes; with
+# threads, avoid drawing other figures while a write is pending, since
+# matplotlib is not thread safe.
+class FigureWriter():
+
+    def __init__(self, workers=1, processes=True):
+        Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.pool = Executor(workers)
+        self.pending = []
+
+    def submit(self, plot, themes, dirname="figs", formats=FORMATS):
+        future = self.pool.submit(plot.save_themes, themes, dirname, formats)
+        self.pending.append(future)
+        return future
+
+    # Blocks until every submitted plot is written, raising any error
+    def wait(self):
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self.wait()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Saves a ThemedPlot in one theme (darktheme, name) or, if themes is
+# given, in all of them. With a FigureWriter the saving happens there.
+def _save_plot(plot, darktheme, name, dirname, themes, formats, writer):
+    if themes is None:
+        themes = {darktheme: name}
+    prof = profiling.active
+    if prof is not None:
+        start = prof.start()
+    # With a writer this only times the hand-off
+    if writer is None:
+        plot.save_themes(themes, dirname, formats)
+    else:
+        writer.submit(plot, themes, dirname, formats)
+    if prof is not None:
+        prof.stop('plot', start)
+    return plot
+
+
+# @param themes: Dict of darktheme to file name. Draws once and saves
+#                every theme, instead of darktheme and name. (Optional)
+# @param formats: File formats to write
+# @param writer: A FigureWriter to save in the background (Optional)
 def compareScatter(
     x_list,
     y_lists,
@@ -191,138 +500,16 @@ def compareScatter(
     darktheme=False,
     name="temp_filename",
     dirname="figs",
+    themes=None,
+    formats=FORMATS,
+    writer=None,
 ):
-    x_len = len(x_list)
-    for y_list in y_lists:
-        if len(y_list) != x_len:
-            print(
-                f"Array size mismatch in {title}"
-                + f"\ny len {len(y_list)} != {x_len}"
-            )
-
-    alpha = 0.8
-    if len(y_lists) > 1:
-        alpha = 0.3
-    fig, ax = plt.subplots(1, 1, figsize=(10, 5), dpi=300)
-    # Set up Axis Definition
-    min_x = min(x_list)
-    max_x = max(x_list)
-    min_y = min([min(y_list) for y_list in y_lists])
-    max_y = max([max(y_list) for y_list in y_lists]) 
-    max_y = max_y + (max_y - min_y)*0.05 # 5% vertical buffer
-    if (xrange):
-        min_x = xrange[0]
-        max_x = xrange[1]
-    if (yrange):
-        min_y = yrange[0]
-        max_y = yrange[1]
-    ax.axis([
-        min_x,
-        max_x,
-        min_y,
-        max_y])
-    fg_color = 'white'
-    fg_color2 = 'grey'
-    bg_color='black'
-    if darktheme:
-        fg_color = 'black'
-        fg_color2 = 'grey'
-        bg_color='white'
-    ax.patch.set_facecolor(bg_color)
-    ax.tick_params(color=fg_color, labelcolor=fg_color)
-    for spine in ax.spines.values():
-        spine.set_edgecolor(fg_color)
-    fig.patch.set_facecolor(bg_color)
-    ax.grid(
-        visible=True,
-        alpha=0.7,
-        color=fg_color,
-        linewidth=0.5,
-    )
-    
-    if y_labels == None:
-        for i, y_list in enumerate(y_lists):
-            ax.fill_between(
-                x_list,
-                y_list,
-                color=get_color(i, darktheme),
-                alpha=alpha,
-                edgecolor=get_color(i, darktheme),
-                linewidth=0.5,
-            )
-            ax.scatter(
-                x_list, y_list,
-                color=get_color(i, darktheme),
-                s=size,
-                alpha=alpha + ((1-alpha)/2),
-            )
-    else:
-        for i, label in enumerate(y_labels):
-            ax.fill_between(
-                x_list,
-                y_lists[i],
-                color=get_color(i, darktheme),
-                alpha=alpha,
-                edgecolor=get_color(i, darktheme),
-                linewidth=0.5,
-                label=label,
-            )
-            ax.scatter(
-                x_list, y_lists[i],
-                color=get_color(i, darktheme),
-                alpha=alpha + ((1-alpha)/2),
-                s=size,
-            )
-        ax.legend(loc=legend_pos, facecolor=bg_color, framealpha=0.5)
-    # if len(y_lists) == 1 and label_vals:
-    #     for i, x in enumerate(x_list):
-    #         text_str = f'{np.round(y_lists[0][i], 2).__float__()}'
-    #         flip = 1 # 1 => left side, 0 => right side
-    #         if i == 0:
-    #             flip = 0 # First label should be right of point
-    #         elif i < len(x_list)-1 and i > 0:
-    #             if y_list[i] < y_list[i-1]: # Was decreasing, don't put left
-    #                 flip = 0
-    #         if flip:
-    #             x_offset = -1*(len(text_str)+0.5)*size*2
-    #         ax.annotate(
-    #             text_str,
-    #             (x, y_lists[0][i]),
-    #             # xytext=(-len(text_str)*size,-0.5*size),
-    #             xytext=(x_offset,0),
-    #             textcoords="offset pixels",
-    #             color=fg_color,
-    #             fontsize=8)
-    if title:
-        if subtitle:
-            mid = (fig.subplotpars.right + fig.subplotpars.left)/2
-            plt.title(f"{subtitle}", color=fg_color2, size=12)
-            plt.suptitle(f"{title}", color=fg_color, size=18, x=mid)
-        else:
-            plt.title(f"{title}", color=fg_color, size=18)
-    if xlabel:
-        if logx:
-            plt.xscale('log')
-            plt.xlabel(f'Log {xlabel}', color=fg_color)
-        else:
-            plt.xlabel(xlabel, color=fg_color)
-    if ylabel:
-        if logy:
-            plt.yscale('log')
-            plt.ylabel(f'Log {ylabel}', color=fg_color)
-        else:
-            plt.ylabel(ylabel, color=fg_color)
-    svgdirname = dirname + "-svg" 
-    try:
-        makedirs(dirname, exist_ok=True)
-        makedirs(svgdirname, exist_ok=True)
-    except FileExistsError:
-        pass
-    plt.savefig(f"{dirname}/{name}.png")
-    plt.savefig(f"{svgdirname}/{name}.svg", format='svg')
-    plt.clf()
-    plt.close()
+    plot = ThemedPlot(
+        'scatter', x_list, y_lists, y_labels, title, subtitle, xlabel, ylabel,
+        logx, logy, xrange, yrange, legend_pos, size)
+    return _save_plot(plot, darktheme, name, dirname, themes, formats, writer)
 
+# Same options as compareScatter
 def compareLines(
     x_list,
     y_lists,
@@ -340,138 +527,14 @@ def compareLines(
     darktheme=False,
     name="temp_filename",
     dirname="figs",
+    themes=None,
+    formats=FORMATS,
+    writer=None,
 ):
-    x_len = len(x_list)
-    for y_list in y_lists:
-        if len(y_list) != x_len:
-            print(
-                f"Array size mismatch in {title}"
-                + f"\ny len {len(y_list)} != {x_len}"
-            )
-
-    alpha = 0.8
-    if len(y_lists) > 1:
-        alpha = 0.3
-    fig, ax = plt.subplots(1, 1, figsize=(10, 5), dpi=300)
-    # Set up Axis Definition
-    min_x = min(x_list)
-    max_x = max(x_list)
-    min_y = min([min(y_list) for y_list in y_lists])
-    max_y = max([max(y_list) for y_list in y_lists]) 
-    max_y = max_y + (max_y - min_y)*0.05 # 5% vertical buffer
-    if (xrange):
-        min_x = xrange[0]
-        max_x = xrange[1]
-    if (yrange):
-        min_y = yrange[0]
-        max_y = yrange[1]
-    ax.axis([
-        min_x,
-        max_x,
-        min_y,
-        max_y])
-    fg_color = 'black'
-    fg_color2 = '#1a1a1a'
-    bg_color='white'
-    if darktheme:
-        fg_color = 'white'
-        fg_color2 = '#D9D9D9'
-        bg_color='black'
-    ax.patch.set_facecolor(bg_color)
-    ax.tick_params(color=fg_color, labelcolor=fg_color)
-    for spine in ax.spines.values():
-        spine.set_edgecolor(fg_color)
-    fig.patch.set_facecolor(bg_color)
-    ax.grid(
-        visible=True,
-        alpha=0.7,
-        color=fg_color,
-        linewidth=0.5,
-    )
-    
-    if y_labels == None:
-        for i, y_list in enumerate(y_lists):
-            ax.plot(
-                x_list,
-                y_list,
-                color=get_color(i, darktheme),
-                alpha=alpha,
-                # edgecolor="black",
-                linewidth=2,
-            )
-            ax.scatter(
-                x_list, y_list,
-                color=get_color(i, darktheme),
-                s=size,
-                alpha=alpha + ((1-alpha)/2),
-            )
-    else:
-        for i, label in enumerate(y_labels):
-            ax.plot(
-                x_list,
-                y_lists[i],
-                color=get_color(i, darktheme),
-                alpha=alpha,
-                # edgecolor="black",
-                linewidth=2,
-                label=label,
-            )
-            ax.scatter(
-                x_list, y_lists[i],
-                color=get_color(i, darktheme),
-                alpha=alpha + ((1-alpha)/2),
-                s=size,
-            )
-        ax.legend(loc=legend_pos, facecolor=bg_color, framealpha=0.5)
-    # if len(y_lists) == 1 and label_vals:
-    #     for i, x in enumerate(x_list):
-    #         text_str = f'{np.round(y_lists[0][i], 2).__float__()}'
-    #         flip = 1 # 1 => left side, 0 => right side
-    #         if i == 0:
-    #             flip = 0 # First label should be right of point
-    #         elif i < len(x_list)-1 and i > 0:
-    #             if y_list[i] < y_list[i-1]: # Was decreasing, don't put left
-    #                 flip = 0
-    #         if flip:
-    #             x_offset = -1*(len(text_str)+0.5)*size*2
-    #         ax.annotate(
-    #             text_str,
-    #             (x, y_lists[0][i]),
-    #             # xytext=(-len(text_str)*size,-0.5*size),
-    #             xytext=(x_offset,0),
-    #             textcoords="offset pixels",
-    #             color=fg_color,
-    #             fontsize=8)
-    if title:
-        if subtitle:
-            mid = (fig.subplotpars.right + fig.subplotpars.left)/2
-            plt.title(f"{subtitle}", color=fg_color2, size=14)
-            plt.suptitle(f"{title}", color=fg_color, size=18, x=mid)
-        else:
-            plt.title(f"{title}", color=fg_color, size=18)
-    if xlabel:
-        if logx:
-            plt.xscale('log')
-            plt.xlabel(f'Log {xlabel}', color=fg_color)
-        else:
-            plt.xlabel(xlabel, color=fg_color)
-    if ylabel:
-        if logy:
-            plt.yscale('log')
-            # ax.yaxis.set_major_formatter(ticker.FuncFormatter(myLogFormat))
-            plt.ylabel(f'Log {ylabel}', color=fg_color)
-        else:
-            plt.ylabel(ylabel, color=fg_color)
-    svgdirname = dirname + "-svg" 
-    try:
-        makedirs(dirname, exist_ok=True)
-        makedirs(svgdirname, exist_ok=True)
-    except FileExistsError:
-        pass
-    plt.savefig(f"{dirname}/{name}.png")
-    plt.savefig(f"{svgdirname}/{name}.svg", format='svg')
-    plt.clf()
-    plt.close()
+    plot = ThemedPlot(
+        'lines', x_list, y_lists, y_labels, title, subtitle, xlabel, ylabel,
+        logx, logy, xrange, yrange, legend_pos, size)
+    return _save_plot(plot, darktheme, name, dirname, themes, formats, writer)
 
 def manyLines(
     x_list,
@@ -489,119 +552,10 @@ def manyLines(
     size=10,
     name="temp_filename",
     dirname="figs",
+    formats=FORMATS,
+    writer=None,
 ):
-    x_len = len(x_list)
-    for y_list in y_lists:
-        if len(y_list) != x_len:
-            print(
-                f"Array size mismatch in {title}"
-                + f"\ny len {len(y_list)} != {x_len}"
-            )
-
-    alpha = 0.8
-    if len(y_lists) > 1:
-        alpha = 0.3
-    fig, ax = plt.subplots(1, 1, figsize=(10, 5), dpi=300)
-    # Set up Axis Definition
-    min_x = min(x_list)
-    max_x = max(x_list)
-    min_y = min([min(y_list) for y_list in y_lists])
-    max_y = max([max(y_list) for y_list in y_lists]) 
-    max_y = max_y + (max_y - min_y)*0.05 # 5% vertical buffer
-    if (xrange):
-        min_x = xrange[0]
-        max_x = xrange[1]
-    if (yrange):
-        min_y = yrange[0]
-        max_y = yrange[1]
-    ax.axis([
-        min_x,
-        max_x,
-        min_y,
-        max_y])
-    fg_color = 'black'
-    fg_color2 = '#1a1a1a'
-    bg_color='white'
-    ax.patch.set_facecolor(bg_color)
-    ax.tick_params(color=fg_color, labelcolor=fg_color)
-    for spine in ax.spines.values():
-        spine.set_edgecolor(fg_color)
-    fig.patch.set_facecolor(bg_color)
-    ax.grid(
-        visible=True,
-        alpha=0.2,
-        color=fg_color2,
-        linewidth=0.5,
-    )
-    
-    if y_labels == None:
-        for i, y_list in enumerate(y_lists):
-            ax.plot(
-                x_list,
-                y_list,
-                color="black",
-                alpha=alpha,
-                # edgecolor="black",
-                linewidth=1,
-            )
-    else:
-        for i, label in enumerate(y_labels):
-            ax.fill_between(
-                x_list,
-                y_lists[i],
-                color="black",
-                alpha=alpha,
-                # edgecolor="black",
-                linewidth=1,
-                label=label,
-            )
-        ax.legend(loc=legend_pos)
-    # if len(y_lists) == 1 and label_vals:
-    #     for i, x in enumerate(x_list):
-    #         text_str = f'{np.round(y_lists[0][i], 2).__float__()}'
-    #         flip = 1 # 1 => left side, 0 => right side
-    #         if i == 0:
-    #             flip = 0 # First label should be right of point
-    #         elif i < len(x_list)-1 and i > 0:
-    #             if y_list[i] < y_list[i-1]: # Was decreasing, don't put left
-    #                 flip = 0
-    #         if flip:
-    #             x_offset = -1*(len(text_str)+0.5)*size*2
-    #         ax.annotate(
-    #             text_str,
-    #             (x, y_lists[0][i]),
-    #             # xytext=(-len(text_str)*size,-0.5*size),
-    #             xytext=(x_offset,0),
-    #             textcoords="offset pixels",
-    #             color=fg_color,
-    #             fontsize=8)
-    if title:
-        if subtitle:
-            mid = (fig.subplotpars.right + fig.subplotpars.left)/2
-            plt.title(f"{subtitle}", color=fg_color2, size=14)
-            plt.suptitle(f"{title}", color=fg_color, size=18, x=mid)
-        else:
-            plt.title(f"{title}", color=fg_color, size=18)
-    if xlabel:
-        if logx:
-            plt.xscale('log')
-            plt.xlabel(f'Log {xlabel}', color=fg_color)
-        else:
-            plt.xlabel(xlabel, color=fg_color)
-    if ylabel:
-        if logy:
-            plt.yscale('log')
-            # ax.yaxis.set_major_formatter(ticker.FuncFormatter(myLogFormat))
-            plt.ylabel(f'Log {ylabel}', color=fg_color)
-        else:
-            plt.ylabel(ylabel, color=fg_color)
-    svgdirname = dirname + "-svg" 
-    try:
-        makedirs(dirname, exist_ok=True)
-        makedirs(svgdirname, exist_ok=True)
-    except FileExistsError:
-        pass
-    plt.savefig(f"{dirname}/{name}.png")
-    plt.savefig(f"{svgdirname}/{name}.svg", format='svg')
-    plt.clf()
-    plt.close()
+    plot = ThemedPlot(
+        'many', x_list, y_lists, y_labels, title, subtitle, xlabel, ylabel,
+        logx, logy, xrange, yrange, legend_pos, size)
+    return _save_plot(plot, False, name, dirname, None, formats, writer)
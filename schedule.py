@@ -0,0 +1,219 @@
+'''
+Description:
+*   Update schedules for a RoundEngine. A schedule decides which games
+    are played and in what order. step() advances one time step: a full
+    sweep for the synchronous schedule, and as many single games as there
+    are edges (or nodes) for the asynchronous ones.
+*   Asynchronous schedules pick their games from the snapshot's arrays
+    in batches, one vectorized draw per batch, so each game costs O(1)
+    no matter how large the graph is. A batch is then played in order
+    by RoundEngine.play_edges, so a takeover is seen by every later game.
+*   Samples carry the edge id of every game, for engines that keep state
+    per edge (MemoryOneEngine).
+'''
+import numpy as np
+from helpers import make_rng
+
+
+# The sweep over G.edges() played by update_scores
+class SynchronousSchedule():
+
+    def step(self, engine, takeover=True, rng=None):
+        engine.play_round(takeover=takeover, rng=rng)
+
+    def run(self, engine, n_rounds, takeover=True, rng=None):
+        for played in range(n_rounds):
+            if takeover and engine.is_absorbing():
+                engine.fast_forward(n_rounds - played, rng)
+                return
+            self.step(engine, takeover, rng)
+
+    # Score gained per step once the engine is absorbing: every choice
+    # is fixed, so a sweep always pays the same
+    def absorbed_gain(self, engine):
+        return engine.round_payoffs()
+
+
+# Random-sequential updates: each game is a live edge picked uniformly
+# at random, with replacement
+class RandomSequentialSchedule():
+
+    def __init__(self, batch_size=65536):
+        self.batch_size = batch_size
+
+    '''
+    @return: (src, dst, edges): the players of each game, as for
+             RoundEngine.play_edges, and the id of the edge it is played on
+    '''
+    def sample(self, engine, n, rng):
+        graph = engine.graph
+        edges = graph.live_edge_ids()
+        if len(edges) == 0:
+            return graph.src[edges], graph.dst[edges], edges
+        edges = edges[rng.integers(len(edges), size=n)]
+        return graph.src[edges], graph.dst[edges], edges
+
+    # Games per step, so one step costs about as much as a sweep
+    def step_size(self, engine):
+        return engine.num_edges()
+
+    '''
+    Play single games, in batches. A sample can hold fewer games than
+    asked for (NodeSchedule drops picks of dead neighbors), so batches
+    are drawn until n_events games have been played.
+    @param n_events: Number of games to play
+    @return: The number of games played, fewer than n_events only if no
+             live edge is left
+    '''
+    def run(self, engine, n_events, takeover=True, rng=None):
+        rng = make_rng(rng)
+        played = 0
+        while played < n_events:
+            size = min(self.batch_size, n_events - played)
+            src, dst, edges = self.sample(engine, size, rng)
+            if len(src) == 0:
+                if engine.num_edges() == 0:
+                    break
+                continue
+            engine.play_edges(src, dst, takeover, rng, edges=edges)
+            played += len(src)
+        return played
+
+    def step(self, engine, takeover=True, rng=None):
+        return self.run(engine, self.step_size(engine), takeover, rng)
+
+    # Random edge picks keep the scores random even once absorbing
+    def absorbed_gain(self, engine):
+        return None
+
+
+# Node-centric (Moran-style) updates: a uniformly random live node plays
+# a uniformly random live neighbor. Nodes with no live neighbor sit out.
+# The focal node is src, so a game can face its edge's dst as src.
+class NodeSchedule(RandomSequentialSchedule):
+
+    def sample(self, engine, n, rng):
+        graph = engine.graph
+        live_nodes = graph.live_nodes()
+        if len(live_nodes) == 0:
+            return live_nodes, live_nodes, live_nodes
+        focal = live_nodes[rng.integers(len(live_nodes), size=n)]
+        starts = graph.indptr[focal]
+        degree = graph.indptr[focal + 1] - starts
+        has_nbrs = degree > 0
+        if not has_nbrs.any():
+            return focal[has_nbrs], focal[has_nbrs], focal[has_nbrs]
+        picks = np.where(has_nbrs, starts + (rng.random(n) * degree).astype(np.intp), 0)
+        nbrs = graph.indices[picks]
+        keep = has_nbrs & graph.live[nbrs]
+        return focal[keep], nbrs[keep], graph.edge_of[picks[keep]]
+
+    def step_size(self, engine):
+        return engine.graph.number_of_nodes()
+
+
+'''
+Gillespie-style event updates. Every live edge fires as a Poisson
+process, so games come in continuous time and self.time advances by
+exponential waiting times.
+@param rates: Optional firing rate per snapshot edge (aligned with
+              graph.src). Edges are then sampled with an alias table,
+              still O(1) per game. By default every edge fires at rate 1.
+'''
+class GillespieSchedule(RandomSequentialSchedule):
+
+    def __init__(self, rates=None, batch_size=65536):
+        super().__init__(batch_size)
+        self.rates = None if rates is None else np.asarray(rates, dtype=np.float64)
+        self.time = 0.0
+        self._alias = None
+
+    def total_rate(self, engine):
+        if self.rates is None:
+            return float(engine.num_edges())
+        return self._alias_table(engine)[2]
+
+    def sample(self, engine, n, rng):
+        if self.rates is None:
+            return super().sample(engine, n, rng)
+        table = self._alias_table(engine)[1]
+        if table is None:
+            edges = np.zeros(0, dtype=np.intp)
+        else:
+            edges = table.sample(n, rng)
+        return engine.graph.src[edges], engine.graph.dst[edges], edges
+
+    # Rebuilt only when the live edges change, e.g. after a kill. With
+    # no live edge left to fire there is no table, and no event.
+    def _alias_table(self, engine):
+        live_edges = engine.graph.live_edges()
+        if self._alias is None or self._alias[0] is not live_edges:
+            weights = np.where(engine.graph.edge_live(), self.rates, 0)
+            total = float(weights.sum())
+            self._alias = (live_edges, AliasTable(weights) if total > 0 else None, total)
+        return self._alias
+
+    '''
+    Play games in event order, advancing self.time
+    @param n_events: Number of games to play (None for no limit)
+    @param t_end: Stop once the clock would pass this time (Optional)
+    @return: The number of games played
+    '''
+    def run(self, engine, n_events, takeover=True, rng=None, t_end=None):
+        rng = make_rng(rng)
+        played = 0
+        while n_events is None or played < n_events:
+            total = self.total_rate(engine)
+            if total <= 0:
+                break
+            size = self.batch_size
+            if n_events is not None:
+                size = min(size, n_events - played)
+            times = self.time + np.cumsum(rng.exponential(1 / total, size=size))
+            if t_end is not None:
+                size = int(np.searchsorted(times, t_end, side='right'))
+                if size == 0:
+                    # Waiting times are memoryless, so the clock can
+                    # stop at t_end without biasing the next event
+                    self.time = t_end
+                    break
+            src, dst, edges = self.sample(engine, size, rng)
+            engine.play_edges(src, dst, takeover, rng, edges=edges)
+            self.time = float(times[size - 1])
+            played += size
+        return played
+
+    def run_until(self, engine, t_end, takeover=True, rng=None):
+        return self.run(engine, None, takeover, rng, t_end=t_end)
+
+
+# Walker's alias method: O(n) to build, O(1) per sample
+class AliasTable():
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        if not weights.sum() > 0:
+            raise ValueError("Alias table weights must have a positive sum")
+        self.prob = np.zeros(n)
+        self.alias = np.zeros(n, dtype=np.intp)
+        scaled = (weights * n / weights.sum()).tolist()
+        small = [i for i, w in enumerate(scaled) if w < 1]
+        large = [i for i, w in enumerate(scaled) if w >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+        for i in small + large:
+            self.prob[i] = 1
+
+    def sample(self, n, rng):
+        picks = rng.integers(len(self.prob), size=n)
+        keep = rng.random(n) < self.prob[picks]
+        return np.where(keep, picks, self.alias[picks])
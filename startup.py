@@ -0,0 +1,69 @@
+'''
+Description:
+*   Import-time budget for the simulation core. Pool workers import the
+    core in every process, so it must load quickly and without the
+    plotting stack: plotly, imageio and matplotlib (and networkx, which
+    is only needed to build graphs and write node attributes, and Numba,
+    which the kernel loads on its first sweep).
+*   Imports are timed in a fresh interpreter, since anything already
+    imported here would be free. Run as a script to print the report:
+        python startup.py
+'''
+import json
+import subprocess
+import sys
+
+CORE_MODULES = [
+    'helpers', 'profiling', 'node', 'agents', 'graph', 'compact', 'game', 'kill', 'kernel', 'engine',
+    'recorder', 'schedule', 'store', 'pool', 'sweep',
+]
+HEAVY_MODULES = ['networkx', 'plotly', 'imageio', 'matplotlib', 'kaleido', 'numba']
+# Seconds, with numpy (about 0.1 s by itself) included
+IMPORT_BUDGET = 0.5
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'seconds': elapsed,
+    'heavy': [m for m in {heavy!r} if m in sys.modules],
+}}))
+'''
+
+
+'''
+Time importing some modules in a fresh interpreter
+@param modules: Module names, imported in order
+@return: Dict with 'seconds' taken and the 'heavy' modules that got
+         imported along the way
+'''
+def measure_imports(modules=CORE_MODULES):
+    probe = _PROBE.format(modules=list(modules), heavy=HEAVY_MODULES)
+    out = subprocess.run(
+        [sys.executable, '-c', probe], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+'''
+Check the core against the budget
+@param repeat: Measurements to take. The fastest counts, as the others
+               mostly measure a cold disk cache.
+@return: The report from measure_imports
+@raise RuntimeError: If the core imports a heavy module or is too slow
+'''
+def check_core_imports(budget=IMPORT_BUDGET, repeat=3):
+    reports = [measure_imports() for _ in range(repeat)]
+    report = min(reports, key=lambda r: r['seconds'])
+    if report['heavy']:
+        raise RuntimeError(f"Core imports {', '.join(report['heavy'])}")
+    if report['seconds'] > budget:
+        raise RuntimeError(f"Core import took {report['seconds']:.3f}s, budget is {budget}s")
+    return report
+
+
+if __name__ == '__main__':
+    report = check_core_imports()
+    print(f"Core import: {report['seconds']*1000:.1f} ms (budget {IMPORT_BUDGET*1000:.0f} ms)")
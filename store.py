@@ -0,0 +1,153 @@
+'''
+Description:
+*   Columnar on-disk store for experiment results. Rows are buffered in
+    memory and written in chunks as shards, one directory per shard and
+    one .npy file per column:
+        results/<name>/shard_000000/family.npy
+        results/<name>/shard_000000/coop_prop.npy
+        ...
+*   Every shard has the key columns (run, family, n, params, coop_prop,
+    replicate, step) followed by whatever metric columns the experiment
+    recorded. Each ResultsStore opened on a directory writes under a new
+    run id, and select reads the latest run that has matching rows, so
+    running an experiment again replaces its results instead of mixing
+    both runs. Columns are loaded with numpy's memory mapping, so
+    re-plotting reads only what it needs and never re-simulates.
+'''
+from os import makedirs, listdir, rename
+from os.path import join, isdir
+import numpy as np
+
+KEY_COLUMNS = ['run', 'family', 'n', 'params', 'coop_prop', 'replicate', 'step']
+KEY_DTYPES = {
+    'run': np.int64,
+    'family': str,
+    'n': np.int64,
+    'params': str,
+    'coop_prop': np.float64,
+    'replicate': np.int64,
+    'step': np.int64,
+}
+
+
+class ResultsStore():
+
+    '''
+    @param path: Directory holding the shards, created if needed
+    @param chunk_rows: Buffered rows that trigger a shard write
+    @param run: Run id for the rows appended (default: one more than
+                the last run in the directory)
+    '''
+    def __init__(self, path, chunk_rows=65536, run=None):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self._buffer = {}
+        self._buffered = 0
+        makedirs(path, exist_ok=True)
+        self.run = self.last_run() + 1 if run is None else run
+
+    # Latest run id on disk, -1 if there is none. Shards written before
+    # runs were recorded count as run 0.
+    def last_run(self):
+        last = -1
+        for shard in self.shards():
+            if 'run' in self.shard_columns(shard):
+                runs = self.read_shard(shard, ['run'])['run']
+                last = max(last, int(runs.max()) if len(runs) else -1)
+            else:
+                last = max(last, 0)
+        return last
+
+    '''
+    Add rows. Scalars are broadcast against array arguments.
+    @param metrics: Metric columns, e.g. mean_coop_prob=series
+    '''
+    def append(self, family, n, params, coop_prop, replicate, step, **metrics):
+        columns = dict(
+            run=self.run, family=family, n=n, params=params, coop_prop=coop_prop,
+            replicate=replicate, step=step, **metrics)
+        arrays = np.broadcast_arrays(*[np.asarray(v) for v in columns.values()])
+        rows = arrays[0].size
+        if self._buffer and set(self._buffer) != set(columns):
+            # A new column set starts a new shard
+            self.flush()
+        for name, values in zip(columns, arrays):
+            dtype = KEY_DTYPES.get(name, np.float64)
+            self._buffer.setdefault(name, []).append(np.asarray(values, dtype=dtype).ravel())
+        self._buffered += rows
+        if self._buffered >= self.chunk_rows:
+            self.flush()
+
+    # Writes buffered rows as a new shard
+    def flush(self):
+        if not self._buffered:
+            return
+        shard = f'shard_{len(self.shards()):06d}'
+        tmp_dir = join(self.path, f'.{shard}.tmp')
+        makedirs(tmp_dir, exist_ok=True)
+        for name, chunks in self._buffer.items():
+            np.save(join(tmp_dir, f'{name}.npy'), np.concatenate(chunks))
+        # Readers only ever see complete shards
+        rename(tmp_dir, join(self.path, shard))
+        self._buffer = {}
+        self._buffered = 0
+
+    def shards(self):
+        return sorted(
+            d for d in listdir(self.path)
+            if d.startswith('shard_') and isdir(join(self.path, d)))
+
+    def shard_columns(self, shard):
+        return [f[:-4] for f in sorted(listdir(join(self.path, shard))) if f.endswith('.npy')]
+
+    def read_shard(self, shard, columns=None):
+        if columns is None:
+            columns = self.shard_columns(shard)
+        return {
+            name: np.load(join(self.path, shard, f'{name}.npy'), mmap_mode='r')
+            for name in columns}
+
+    '''
+    Rows matching every key given in where, from the shards that have
+    all the requested columns
+    @param columns: Columns to return (default: all in the first shard)
+    @param run: 'latest' for the rows of the latest run with any match,
+                None for every run, or a run id
+    @param where: Exact matches on columns, e.g. family='gnp'
+    @return: Dict of column name to array
+    '''
+    def select(self, columns=None, run='latest', **where):
+        self.flush()
+        matches = []
+        for shard in self.shards():
+            available = self.shard_columns(shard)
+            if columns is None:
+                columns = [name for name in available if name != 'run']
+            if not set(columns).issubset(available) or not set(where).issubset(available):
+                continue
+            data = self.read_shard(shard, set(columns) | set(where) | {'step'})
+            mask = np.ones(len(data['step']), dtype=bool)
+            for name, value in where.items():
+                mask &= data[name] == value
+            if not mask.any():
+                continue
+            if 'run' in available:
+                runs = np.asarray(self.read_shard(shard, ['run'])['run'][mask])
+            else:
+                runs = np.zeros(np.count_nonzero(mask), dtype=np.int64)
+            matches.append((data, mask, runs))
+        if run == 'latest':
+            run = max((int(runs.max()) for _, _, runs in matches), default=None)
+        parts = {}
+        for data, mask, runs in matches:
+            keep = np.ones(len(runs), dtype=bool) if run is None else runs == run
+            if not keep.any():
+                continue
+            for name in columns:
+                parts.setdefault(name, []).append(np.asarray(data[name][mask])[keep])
+        return {
+            name: np.concatenate(parts[name]) if name in parts else np.array([])
+            for name in (columns or [])}
+
+    def __repr__(self):
+        return f"ResultsStore({self.path}, {len(self.shards())} shards)"
@@ -0,0 +1,321 @@
+'''
+Description:
+*   Parallel runner for the test_proportions sweep. Every
+    (graph, coop_prop, replicate) is an independent task, so tasks are
+    spread over a ProcessPoolExecutor and their totals are streamed back
+    to the parent as they finish.
+*   Each task seeds its own numpy Generator from a SeedSequence keyed on
+    the task itself, so results are the same whatever the worker count
+    or completion order.
+*   By default (batched=True) a task is a batch of replicates, across
+    proportions, run together by a BatchEngine. Every replicate keeps
+    its own Generator, so the results match the unbatched sweep.
+*   Parallel edges are played once per multiplicity ('expand'), as by
+    update_scores. The 'weighted' and 'binomial' multiedges modes of
+    RoundEngine are opt-in: they only change multigraphs, where they
+    play one game per distinct edge and so draw other random numbers.
+'''
+from math import floor
+import numpy as np
+from graph import add_agents
+from engine import RoundEngine
+from compact import CompactGraph
+from recorder import Recorder
+from analytic import expected_scores
+from batch import BatchEngine, batch_rows
+from pool import run_tasks
+
+PROPORTIONS = [0.005 * i for i in range(4)] + [0.02 * i for i in range(1, 51)]
+
+
+# Starting coop_probs used by test_proportions: the first
+# floor(n*coop_prop) nodes always cooperate, the rest always defect
+def proportion_agents(n, coop_prop):
+    n_coop = int(floor(n*coop_prop))
+    return [1.0]*n_coop + [0.0]*(n-n_coop)
+
+
+'''
+Simulate one replicate of test_proportions
+@param G: A CompactGraph (or networkx graph) to populate
+@param rng: numpy Generator for this replicate
+@param multiedges: One of MULTIEDGE_MODES, as for RoundEngine
+@return: (coop score sum, coop count, defect score sum, defect count)
+'''
+def run_replicate(G, coop_prop, rng, n_rounds=20, takeover=False, multiedges='expand'):
+    add_agents(G, 0, proportion_agents(len(G), coop_prop))
+    engine = RoundEngine.from_graph(G, multiedges=multiedges)
+    recorder = Recorder(capacity=1).attach(engine)
+    for _ in range(n_rounds):
+        engine.play_round(takeover=takeover, rng=rng)
+    return (
+        recorder.coop_score_sum, recorder.n_coop,
+        recorder.all_score_sum - recorder.coop_score_sum, recorder.n_defect())
+
+
+'''
+Simulate several replicates of test_proportions together
+@param G: A CompactGraph (or networkx graph)
+@param coop_props: Starting proportion of each replicate
+@param rngs: One numpy Generator per replicate
+@param multiedges: One of MULTIEDGE_MODES, as for RoundEngine
+@return: One run_replicate tuple per replicate, identical to what
+         run_replicate returns given the same Generator
+'''
+def run_replicates(G, coop_props, rngs, n_rounds=20, takeover=False, multiedges='expand'):
+    if not isinstance(G, CompactGraph):
+        G = CompactGraph.from_networkx(G)
+    coop_prob = np.array([proportion_agents(len(G), coop_prop) for coop_prop in coop_props])
+    engine = BatchEngine(G, coop_prob, multiedges=multiedges)
+    for _ in range(n_rounds):
+        engine.play_round(takeover=takeover, rng=rngs)
+    return engine.totals()
+
+
+'''
+Expected value of run_replicate, computed instead of simulated
+@param G: A CompactGraph (or networkx graph)
+@return: (coop score sum, coop count, defect score sum, defect count)
+'''
+def expected_replicate(G, coop_prop, n_rounds=20, threshold=0.5):
+    if not isinstance(G, CompactGraph):
+        G = CompactGraph.from_networkx(G)
+    coop_prob = np.array(proportion_agents(len(G), coop_prop))
+    mean, _ = expected_scores(G, coop_prob, n_rounds)
+    is_coop = (coop_prob >= threshold) & G.live
+    is_defect = G.live & ~is_coop
+    return (
+        float(mean[is_coop].sum()), int(np.count_nonzero(is_coop)),
+        float(mean[is_defect].sum()), int(np.count_nonzero(is_defect)))
+
+
+# Appends one run_replicate result to a ResultsStore
+def store_replicate(store, label, coop_prop, replicate, n_rounds, result):
+    family, n, params = label
+    coop_sum, coop_count, defect_sum, defect_count = result
+    store.append(
+        family, n, params, coop_prop, replicate, n_rounds,
+        coop_score_sum=coop_sum,
+        coop_count=coop_count,
+        defect_score_sum=defect_sum,
+        defect_count=defect_count)
+
+
+'''
+Rebuild the sweep's y_lists from a ResultsStore without simulating
+@param label: (family, n, params) the sweep was stored under
+@return: y_lists as returned by run_proportion_sweep for that graph
+'''
+def load_proportion_sweep(store, label, proportions=PROPORTIONS):
+    family, n, params = label
+    rows = store.select(
+        ['coop_prop', 'coop_score_sum', 'coop_count', 'defect_score_sum', 'defect_count'],
+        family=family, n=n, params=params)
+    totals = {p: ProportionTotals() for p in range(len(proportions))}
+    p_index = {coop_prop: p for p, coop_prop in enumerate(proportions)}
+    for coop_prop, *result in zip(*rows.values()):
+        totals[p_index[coop_prop]].add(result)
+    return [
+        [totals[p].defect_years() for p in totals],
+        [totals[p].coop_years() for p in totals],
+        [totals[p].all_years() for p in totals]]
+
+
+# Running totals of every finished replicate for one (graph, coop_prop)
+class ProportionTotals():
+
+    def __init__(self):
+        self.coop_sum = 0.0
+        self.coop_count = 0
+        self.defect_sum = 0.0
+        self.defect_count = 0
+        self.replicates = 0
+
+    def add(self, result):
+        coop_sum, coop_count, defect_sum, defect_count = result
+        self.coop_sum += coop_sum
+        self.coop_count += coop_count
+        self.defect_sum += defect_sum
+        self.defect_count += defect_count
+        self.replicates += 1
+
+    # Every replicate has the same group sizes, so pooling the scores
+    # equals test_proportions' mean of per-replicate means.
+    # An empty group counts as 0 years, as in test_proportions.
+    def defect_years(self):
+        return self.defect_sum / self.defect_count if self.defect_count else 0
+
+    def coop_years(self):
+        return self.coop_sum / self.coop_count if self.coop_count else 0
+
+    def all_years(self):
+        return (self.defect_years() + self.coop_years()) / 2
+
+    def __repr__(self):
+        return (f"({self.replicates} replicates: defect {self.defect_years()}, "
+                f"coop {self.coop_years()})")
+
+
+# Per-worker state, sent once through the pool initializer
+_worker = {}
+
+
+def _init_worker(graphs, proportions, n_rounds, entropy, multiedges):
+    _worker['graphs'] = graphs
+    _worker['proportions'] = proportions
+    _worker['n_rounds'] = n_rounds
+    _worker['entropy'] = entropy
+    _worker['multiedges'] = multiedges
+
+
+def _task_rng(task):
+    return np.random.default_rng(np.random.SeedSequence(_worker['entropy'], spawn_key=task))
+
+
+def _run_task(task):
+    g, p, r = task
+    result = run_replicate(
+        _worker['graphs'][g],
+        _worker['proportions'][p],
+        _task_rng(task),
+        n_rounds=_worker['n_rounds'],
+        multiedges=_worker['multiedges'])
+    return [(task, result)]
+
+
+# Every graph as a CompactGraph, so workers and batches share one
+# snapshot instead of rebuilding it for each replicate
+def _snapshots(graphs):
+    return [G if isinstance(G, CompactGraph) else CompactGraph.from_networkx(G) for G in graphs]
+
+
+# A batch of (g, p, r) tasks, all on the same graph
+def _run_batch(tasks):
+    g = tasks[0][0]
+    results = run_replicates(
+        _worker['graphs'][g],
+        [_worker['proportions'][p] for _, p, _ in tasks],
+        [_task_rng(task) for task in tasks],
+        n_rounds=_worker['n_rounds'],
+        multiedges=_worker['multiedges'])
+    return list(zip(tasks, results))
+
+
+# Tasks split into batches of one graph each, sized by batch_rows
+def _batches(graphs, tasks):
+    batches = []
+    for g, G in enumerate(graphs):
+        graph_tasks = [task for task in tasks if task[0] == g]
+        rows = batch_rows(G.number_of_edges())
+        batches += [graph_tasks[i:i + rows] for i in range(0, len(graph_tasks), rows)]
+    return batches
+
+
+'''
+Run the proportion sweep and stream the totals as tasks finish
+@param graphs: List of CompactGraphs to sweep. networkx graphs are
+               snapshotted once here, not once per replicate.
+@param proportions: Starting proportions of cooperators
+@param n_iter: Replicates per (graph, proportion)
+@param n_rounds: Rounds per replicate
+@param seed: Root seed. None draws fresh entropy.
+@param workers: Worker processes. None uses every core, 1 runs inline.
+@param batched: Run replicates in batches with a BatchEngine. Results
+                are the same, only faster. False runs one task per
+                replicate.
+@param multiedges: One of MULTIEDGE_MODES, as for RoundEngine. Only
+                   multigraphs are affected.
+@return: Yields (graph index, proportion index, replicate, result,
+         ProportionTotals) after every finished replicate, where result
+         is that replicate's run_replicate tuple
+'''
+def iter_proportion_sweep(
+    graphs,
+    proportions=PROPORTIONS,
+    n_iter=10,
+    n_rounds=20,
+    seed=None,
+    workers=None,
+    batched=True,
+    multiedges='expand'):
+    graphs = _snapshots(graphs)
+    entropy = np.random.SeedSequence(seed).entropy
+    totals = {}
+    tasks = [
+        (g, p, r)
+        for g in range(len(graphs))
+        for p in range(len(proportions))
+        for r in range(n_iter)]
+    init_args = (graphs, proportions, n_rounds, entropy, multiedges)
+    if batched:
+        run, tasks = _run_batch, _batches(graphs, tasks)
+    else:
+        run = _run_task
+    # run returns a list of (task, result) for each of its tasks
+    for results in run_tasks(run, tasks, _init_worker, init_args, workers, ordered=False):
+        for (g, p, r), result in results:
+            partial = totals.setdefault((g, p), ProportionTotals())
+            partial.add(result)
+            yield g, p, r, result, partial
+
+
+# Same stream as iter_proportion_sweep, with one expected_replicate
+# per (graph, proportion) in place of n_iter simulated replicates
+def iter_expected_sweep(graphs, proportions=PROPORTIONS, n_rounds=20):
+    for g, G in enumerate(_snapshots(graphs)):
+        for p, coop_prop in enumerate(proportions):
+            result = expected_replicate(G, coop_prop, n_rounds)
+            partial = ProportionTotals()
+            partial.add(result)
+            yield g, p, 0, result, partial
+
+
+'''
+Run the proportion sweep to completion
+@param on_update: Called as on_update(done, total, g, p, partial) after
+                  every finished replicate, e.g. for a progress bar
+@param store: Optional ResultsStore. Every replicate's totals are
+              appended to it, labelled with labels[g].
+@param labels: (family, n, params) for each graph, used with store
+@param analytic: Use expected_replicate instead of simulating. Exact
+                 for the expected years, since takeover is off; n_iter,
+                 seed and workers are then unused.
+@param batched, multiedges: As in iter_proportion_sweep
+@return: For each graph, y_lists as plotted by test_proportions:
+         [defector years, cooperator years, all agents]
+'''
+def run_proportion_sweep(
+    graphs,
+    proportions=PROPORTIONS,
+    n_iter=10,
+    n_rounds=20,
+    seed=None,
+    workers=None,
+    on_update=None,
+    store=None,
+    labels=None,
+    analytic=False,
+    batched=True,
+    multiedges='expand'):
+    totals = [[None] * len(proportions) for _ in graphs]
+    if analytic:
+        total = len(graphs) * len(proportions)
+        stream = iter_expected_sweep(graphs, proportions, n_rounds)
+    else:
+        total = len(graphs) * len(proportions) * n_iter
+        stream = iter_proportion_sweep(
+            graphs, proportions, n_iter, n_rounds, seed, workers, batched, multiedges)
+    for done, (g, p, r, result, partial) in enumerate(stream, 1):
+        totals[g][p] = partial
+        if store is not None:
+            store_replicate(store, labels[g], proportions[p], r, n_rounds, result)
+        if on_update:
+            on_update(done, total, g, p, partial)
+    if store is not None:
+        store.flush()
+    return [
+        [
+            [t.defect_years() for t in graph_totals],
+            [t.coop_years() for t in graph_totals],
+            [t.all_years() for t in graph_totals]]
+        for graph_totals in totals]